@@ -6,15 +6,111 @@ class Settings(BaseSettings):
     pexels_api_key: str = ""
     telegram_bot_token: str = ""
     telegram_chat_id: str = ""
+    # Self-hosted Bot API server (e.g. http://telegram-bot-api:8081), which
+    # allows uploads up to 2000 MB; local mode uploads by file path and needs
+    # the server to see MEDIA_DIR at the same path
+    telegram_base_url: str = ""
+    telegram_local_mode: bool = False
+    telegram_pool_size: int = 8
     fal_key: str = ""
+    # Seconds to wait for a fal.ai thumbnail before drawing one from a stock
+    # clip frame instead; generated images are cached up to thumb_cache_bytes
+    thumbnail_timeout: int = 60
+    thumb_cache_bytes: int = 1024**3
+    # YouTube OAuth client; the token is read from MEDIA_DIR/youtube_token.json
+    youtube_client_id: str = ""
+    youtube_client_secret: str = ""
+    youtube_privacy: str = "public"
     media_dir: str = "/media/dhamma"
 
+    # "single_pass" renders concat, scale/pad, title and audio in one encode;
+    # "two_pass" keeps the old visual-intermediate + re-encode path for comparison;
+    # "segmented" encodes ~segment_seconds chunks in segment_workers parallel
+    # ffmpeg processes and joins them with stream copy.
+    compile_mode: str = "single_pass"
+    segment_seconds: int = 300
+    segment_workers: int = 2
+
+    # With normalized clips, re-encode only the keyframe-aligned window under
+    # the title overlay and stream-copy the rest
+    title_window: bool = True
+
+    # Job scheduler: pipelines admitted at once, and per-resource-class stage slots
+    max_concurrent_jobs: int = 3
+    network_concurrency: int = 4
+    cpu_concurrency: int = 1
+    stream_concurrency: int = 2
+
+    # Publish queue: concurrent uploads per process, and attempts per
+    # destination before it is marked failed (retried with backoff)
+    publish_workers: int = 2
+    publish_max_attempts: int = 5
+
+    # Disk budget for the shared stock clip library (LRU-evicted beyond this)
+    stock_cache_bytes: int = 20 * 1024**3
+
+    # Disk budget for cached source + enhanced audio (shared across repeat submissions)
+    audio_cache_bytes: int = 20 * 1024**3
+
+    # Apply the enhancement filter chain inside the compile graph instead of
+    # writing a standalone enhanced file
+    fuse_enhancement: bool = False
+
+    # Pipe the download straight into the enhancer instead of downloading
+    # first (ignored with fuse_enhancement). stream_keep_source also writes
+    # the raw bytes to the source cache, so retries and repeat submissions
+    # with another URL for the same file can reuse them. Streaming downloads
+    # take "stream" slots (stream_concurrency), not network or cpu ones.
+    stream_ingest: bool = False
+    stream_keep_source: bool = True
+
+    # yt-dlp ingest: keep the native audio stream (opus/m4a) instead of
+    # converting to WAV, fetch DASH/HLS fragments concurrently, and reuse
+    # extractor data (player JS, signatures) from MEDIA_DIR/yt-dlp-cache
+    ytdlp_fast_ingest: bool = True
+    ytdlp_concurrent_fragments: int = 4
+
+    # Transcode each stock clip once into a uniform mezzanine so the visual
+    # track can be assembled with stream copy
+    use_mezzanine: bool = True
+    mezzanine_cache_bytes: int = 20 * 1024**3
+
+    # Pre-rendered background reels joined from mezzanine clips; a job whose
+    # audio fits in a reel only trims it and muxes audio. reel_count reels of
+    # reel_minutes each are kept, rebuilt once older than reel_rebuild_hours.
+    # Before a rebuild, reel_topup_clips new Pexels clips join the library.
+    use_reels: bool = True
+    reel_minutes: int = 120
+    reel_count: int = 3
+    reel_rebuild_hours: int = 24
+    reel_topup_clips: int = 5
+    reel_cache_bytes: int = 20 * 1024**3
+
+    # Maximum ffprobe processes running at once
+    probe_concurrency: int = 4
+
+    # Shared HTTP client pool and Pexels fan-out
+    http_max_connections: int = 20
+    pexels_concurrency: int = 4
+    # Start waiting for the rate-limit window reset below this many remaining calls
+    pexels_min_remaining: int = 5
+    # Cached search results are reused this long; each refresh adds another page
+    pexels_search_ttl_hours: int = 24
+    pexels_cache_pages: int = 3
+
+    # Finished jobs older than this are retired from the job store
+    job_retention_days: int = 30
+
     model_config = {"env_file": ".env", "env_file_encoding": "utf-8"}
 
     @property
     def media_path(self) -> Path:
         return Path(self.media_dir)
 
+    @property
+    def db_path(self) -> Path:
+        return self.media_path / "dhamma.db"
+
     @property
     def audio_dir(self) -> Path:
         return self.media_path / "audio"
@@ -27,6 +123,14 @@ class Settings(BaseSettings):
     def stock_dir(self) -> Path:
         return self.media_path / "stock"
 
+    @property
+    def mezzanine_dir(self) -> Path:
+        return self.stock_dir / "mezzanine"
+
+    @property
+    def reels_dir(self) -> Path:
+        return self.stock_dir / "reels"
+
     @property
     def output_dir(self) -> Path:
         return self.media_path / "output"
@@ -35,8 +139,15 @@ class Settings(BaseSettings):
     def thumbs_dir(self) -> Path:
         return self.media_path / "thumbnails"
 
+    @property
+    def ytdlp_cache_dir(self) -> Path:
+        return self.media_path / "yt-dlp-cache"
+
     def ensure_dirs(self):
-        for d in [self.audio_dir, self.video_dir, self.stock_dir, self.output_dir, self.thumbs_dir]:
+        for d in [
+            self.audio_dir, self.video_dir, self.stock_dir, self.mezzanine_dir,
+            self.reels_dir, self.output_dir, self.thumbs_dir, self.ytdlp_cache_dir,
+        ]:
             d.mkdir(parents=True, exist_ok=True)
 
 
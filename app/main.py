@@ -1,16 +1,135 @@
+import asyncio
+import json
+import logging
 import uuid
+from contextlib import asynccontextmanager, suppress
+from datetime import timedelta
 from pathlib import Path
 
-from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
 from app.config import settings
-from app.services.pipeline import JobStatus, jobs, run_pipeline
+from app.services.downloader import expand_playlist, normalize_url
+from app.services.jobstore import FINISHED_STATUSES, WORKER_ID
+from app.services.pipeline import JobStatus, job_store, run_pipeline
+from app.services.publisher import publish_queue
+from app.services.reels import maintain_reels
+from app.services.scheduler import scheduler
+from app.services.http import close_client
+from app.services.telegram_pub import close_bot
+from app.services.youtube_pub import token_file
 
-app = FastAPI(title="Dhamma Audio → Video", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+RETIRE_INTERVAL = 3600
+REELS_INTERVAL = 3600
+# How often each worker checks for cancel requests made through another worker
+CANCEL_POLL_INTERVAL = 2
+# Workers heartbeat this often; unfinished jobs of a worker silent for
+# WORKER_STALE_AFTER seconds (e.g. before a restart) are resumed by another
+HEARTBEAT_INTERVAL = 10
+WORKER_STALE_AFTER = 60
+# SSE: re-read the store this often (catches updates from other workers)
+# and send a keep-alive comment when nothing changed for KEEPALIVE seconds.
+EVENTS_POLL_INTERVAL = 2
+EVENTS_KEEPALIVE = 15
+
+
+async def _retire_jobs_periodically():
+    """Drop finished jobs past the retention window, once an hour."""
+    while True:
+        try:
+            job_store.retire(timedelta(days=settings.job_retention_days))
+        except Exception:
+            logger.exception("Retiring old jobs failed")
+        await asyncio.sleep(RETIRE_INTERVAL)
+
+
+async def _maintain_reels_periodically():
+    """Keep the background reel pool built and rotated, once an hour."""
+    while True:
+        try:
+            await maintain_reels()
+        except Exception:
+            logger.exception("Reel maintenance failed")
+        await asyncio.sleep(REELS_INTERVAL)
+
+
+async def _apply_cancel_requests():
+    """Cancel this worker's jobs that were cancelled through another worker."""
+    while True:
+        await asyncio.sleep(CANCEL_POLL_INTERVAL)
+        try:
+            publishing = publish_queue.jobs
+            local = [*scheduler.running, *scheduler.queued, *publishing]
+            for job_id in job_store.take_cancel_requests(local):
+                if job_id in publishing:
+                    publish_queue.cancel(job_id)
+                else:
+                    _cancel_local(job_id)
+        except Exception:
+            logger.exception("Applying cancel requests failed")
+
+
+async def _resume_orphaned_jobs():
+    """Heartbeat, and pick up unfinished jobs left behind by dead workers.
+
+    Errors are logged and the loop carries on: if it died, other workers
+    would take this worker's running jobs over and run them a second time.
+    """
+    while True:
+        try:
+            job_store.heartbeat()
+            for job in job_store.claim_orphans(WORKER_STALE_AFTER):
+                _resume(job)
+        except Exception:
+            logger.exception("Heartbeat or orphan pickup failed")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def _resume(job: JobStatus):
+    """Resubmit a claimed orphan; one that can't be resubmitted is marked failed."""
+    if not job.params:
+        job.status = "failed"
+        job.error = "Interrupted by a restart"
+        job_store.save(job)
+        return
+    try:
+        _submit(job)
+    except Exception as e:
+        logger.exception("Could not resume job %s", job.id)
+        job.status = "failed"
+        job.error = f"Could not resume: {e}"
+        job_store.save(job)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings.ensure_dirs()
+    job_store.index_sources(normalize_url)
+    tasks = [
+        asyncio.create_task(_retire_jobs_periodically()),
+        asyncio.create_task(_apply_cancel_requests()),
+        asyncio.create_task(_resume_orphaned_jobs()),
+    ]
+    if settings.use_reels and settings.use_mezzanine:
+        tasks.append(asyncio.create_task(_maintain_reels_periodically()))
+    publish_queue.start()
+    yield
+    for task in tasks:
+        task.cancel()
+    with suppress(asyncio.CancelledError):
+        await asyncio.gather(*tasks)
+    await publish_queue.stop()
+    await close_client()
+    await close_bot()
+
+
+app = FastAPI(title="Dhamma Audio → Video", version="1.0.0", lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -23,9 +142,27 @@ class JobRequest(BaseModel):
     title: str
     description: str = ""
     publish_telegram: bool = True
+    publish_youtube: bool = False
     stock_clip_count: int = 5
     generate_thumbnail: bool = True
     thumbnail_prompt: str = ""
+    priority: int = 0
+
+
+class BatchRequest(BaseModel):
+    # Either explicit URLs, a playlist URL expanded with yt-dlp, or both
+    audio_urls: list[str] = []
+    playlist_url: str = ""
+    # Used for entries without a title of their own (numbered per entry)
+    title: str = ""
+    description: str = ""
+    publish_telegram: bool = True
+    publish_youtube: bool = False
+    stock_clip_count: int = 5
+    generate_thumbnail: bool = True
+    thumbnail_prompt: str = ""
+    # Below single submissions by default, so a long series doesn't hold up one-off jobs
+    priority: int = -1
 
 
 class JobResponse(BaseModel):
@@ -42,58 +179,269 @@ async def index(request: Request):
 
 # --- API ---
 
+def _pipeline_params(req: JobRequest | BatchRequest, audio_url: str, title: str) -> dict:
+    """run_pipeline keyword arguments for one talk of a request."""
+    return {
+        "audio_url": audio_url,
+        "title": title,
+        "description": req.description,
+        "publish_telegram": req.publish_telegram,
+        "publish_youtube": req.publish_youtube,
+        "stock_clip_count": req.stock_clip_count,
+        "generate_thumb": req.generate_thumbnail,
+        "thumbnail_prompt": req.thumbnail_prompt,
+    }
+
+
+def _submit(job: JobStatus):
+    """Queue ``job`` on this worker; finished stages in its manifest are skipped."""
+    job.status = "queued"
+    job.worker = WORKER_ID
+    job_store.save(job)
+    job_store.add_source(job.id, normalize_url(job.params["audio_url"]))
+    scheduler.submit(
+        job.id, lambda: run_pipeline(job_id=job.id, **job.params), priority=job.priority
+    )
+
+
 @app.post("/api/jobs", response_model=JobResponse)
-async def create_job(req: JobRequest, background_tasks: BackgroundTasks):
-    job_id = uuid.uuid4().hex[:12]
-    jobs[job_id] = JobStatus(id=job_id)
-    background_tasks.add_task(
-        run_pipeline,
-        job_id=job_id,
-        audio_url=req.audio_url,
-        title=req.title,
-        description=req.description,
-        publish_telegram=req.publish_telegram,
-        stock_clip_count=req.stock_clip_count,
-        generate_thumb=req.generate_thumbnail,
-        thumbnail_prompt=req.thumbnail_prompt,
+async def create_job(req: JobRequest):
+    job = JobStatus(
+        id=uuid.uuid4().hex[:12],
+        priority=req.priority,
+        params=_pipeline_params(req, req.audio_url, req.title),
     )
-    return JobResponse(job_id=job_id, status="pending")
+    _submit(job)
+    return JobResponse(job_id=job.id, status="queued")
 
 
-@app.get("/api/jobs/{job_id}")
-async def get_job(job_id: str):
-    job = jobs.get(job_id)
+@app.post("/api/batches")
+async def create_batch(req: BatchRequest):
+    """Create one job per talk in a list of URLs and/or a playlist.
+
+    URLs repeated in the batch, or already converted (or in progress) by an
+    earlier job, are skipped. Jobs go through the scheduler like single
+    submissions, so only MAX_CONCURRENT_JOBS of them run at a time.
+    """
+    entries = [(url, "") for url in req.audio_urls]
+    if req.playlist_url:
+        try:
+            entries += await expand_playlist(req.playlist_url)
+        except RuntimeError as e:
+            return {"error": str(e)}
+    if not entries:
+        return {"error": "No audio URLs given"}
+
+    batch_id = uuid.uuid4().hex[:12]
+    seen = job_store.find_sources([normalize_url(url) for url, _ in entries])
+    job_ids, skipped = [], []
+    for i, (url, entry_title) in enumerate(entries, 1):
+        key = normalize_url(url)
+        if key in seen:
+            skipped.append({"url": url, "job_id": seen[key]})
+            continue
+        title = entry_title or (f"{req.title} {i}" if req.title else url)
+        job = JobStatus(
+            id=uuid.uuid4().hex[:12],
+            priority=req.priority,
+            batch_id=batch_id,
+            params=_pipeline_params(req, url, title),
+        )
+        seen[key] = job.id
+        job_ids.append(job.id)
+        _submit(job)
+
+    job_store.save_batch(batch_id, {
+        "id": batch_id, "playlist_url": req.playlist_url, "jobs": job_ids, "skipped": skipped,
+    })
+    return {"batch_id": batch_id, "jobs": job_ids, "skipped": skipped}
+
+
+@app.get("/api/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """Aggregate status of a batch: per-status counts and overall progress."""
+    batch = job_store.get_batch(batch_id)
+    if batch is None:
+        return {"error": "Batch not found"}
+    jobs = job_store.get_many(batch["jobs"])
+    counts: dict[str, int] = {}
+    for job in jobs.values():
+        counts[job.status] = counts.get(job.status, 0) + 1
+    total = len(batch["jobs"])
+    progress = sum(j.progress for j in jobs.values()) // total if total else 100
+    return {
+        "id": batch_id,
+        "total": total,
+        "counts": counts,
+        "progress": progress,
+        "finished": all(j.status in FINISHED_STATUSES for j in jobs.values()),
+        "skipped": batch["skipped"],
+        "jobs": [
+            {
+                "id": job_id,
+                "title": jobs[job_id].params.get("title", ""),
+                "status": jobs[job_id].status,
+                "progress": jobs[job_id].progress,
+            }
+            for job_id in batch["jobs"] if job_id in jobs
+        ],
+    }
+
+
+@app.post("/api/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    """Re-run a finished job from its first stage without a checkpointed result."""
+    job = job_store.get(job_id)
     if not job:
         return {"error": "Job not found"}
+    if job.status not in FINISHED_STATUSES:
+        return {"error": f"Job is still {job.status}"}
+    if not job.params:
+        return {"error": "Job has no saved parameters to retry with"}
+    job.error = ""
+    job.progress = 0
+    job.step = ""
+    _submit(job)
+    return JobResponse(job_id=job.id, status="queued")
+
+
+def _job_payload(job: JobStatus) -> dict:
     return {
         "id": job.id,
         "status": job.status,
         "step": job.step,
         "progress": job.progress,
+        "queue_position": scheduler.position(job.id),
         "error": job.error,
         "output_path": job.output_path,
         "thumbnail_path": job.thumbnail_path,
         "telegram_result": job.telegram_result,
+        "youtube_result": job.youtube_result,
+        "stages": job.stages,
     }
 
 
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if not job:
+        return {"error": "Job not found"}
+    return _job_payload(job)
+
+
+def _mark_cancelled(job_id: str):
+    """Record the cancellation of a job whose pipeline never got to run."""
+    job = job_store.get(job_id)
+    if job and job.status == "queued":
+        job.status = "cancelled"
+        job.error = "Cancelled"
+        job_store.save(job)
+
+
+def _cancel_local(job_id: str) -> bool:
+    """Cancel ``job_id`` if this worker owns it."""
+    task = scheduler.running.get(job_id)
+    if not scheduler.cancel(job_id):
+        return False
+    if task is None:
+        # Dropped from the admission queue, so no pipeline will record it
+        _mark_cancelled(job_id)
+    else:
+        # Admitted but cancelled before run_pipeline's first step: the
+        # coroutine never starts, so the job would stay "queued" forever
+        task.add_done_callback(lambda _t: _mark_cancelled(job_id))
+    return True
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job, killing its ffmpeg/yt-dlp processes.
+
+    For a rendered job only its outstanding uploads are cancelled; the video is kept.
+    """
+    job = job_store.get(job_id)
+    if not job:
+        return {"error": "Job not found"}
+    if job.status in FINISHED_STATUSES:
+        return JobResponse(job_id=job_id, status=job.status)
+    if job.status == "rendered":
+        publish_queue.cancel(job_id)
+        status = job_store.get(job_id).status
+        # Running uploads finish the job as they unwind
+        return JobResponse(job_id=job_id, status="cancelling" if status == "rendered" else status)
+    if _cancel_local(job_id):
+        return JobResponse(job_id=job_id, status="cancelled")
+    # Owned by another worker process; it picks the request up shortly
+    job_store.request_cancel(job_id)
+    return JobResponse(job_id=job_id, status="cancelling")
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events stream of job status; ends once the job finishes."""
+
+    async def stream():
+        last_sent = None
+        idle = 0.0
+        with job_store.watch(job_id) as changed:
+            while not await request.is_disconnected():
+                changed.clear()
+                job = job_store.get(job_id)
+                if job is None:
+                    missing = {"id": job_id, "status": "failed", "error": "Job not found"}
+                    yield f"data: {json.dumps(missing)}\n\n"
+                    return
+                payload = _job_payload(job)
+                if payload != last_sent:
+                    last_sent = payload
+                    idle = 0.0
+                    yield f"data: {json.dumps(payload)}\n\n"
+                    if job.status in FINISHED_STATUSES:
+                        return
+                elif idle >= EVENTS_KEEPALIVE:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=EVENTS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    idle += EVENTS_POLL_INTERVAL
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/api/jobs")
-async def list_jobs():
-    return [
-        {
-            "id": j.id,
-            "status": j.status,
-            "step": j.step,
-            "progress": j.progress,
-            "created_at": j.created_at,
-        }
-        for j in sorted(jobs.values(), key=lambda x: x.created_at, reverse=True)
-    ]
+async def list_jobs(
+    limit: int = Query(20, ge=1, le=200),
+    cursor: str = "",
+    status: str = "",
+):
+    """List jobs newest first. ``status`` is a comma-separated filter;
+    pass the returned ``next_cursor`` back as ``cursor`` for the next page."""
+    statuses = [s for s in status.split(",") if s] or None
+    page, next_cursor = job_store.list(limit=limit, cursor=cursor, statuses=statuses)
+    return {
+        "jobs": [
+            {
+                "id": j.id,
+                "status": j.status,
+                "step": j.step,
+                "progress": j.progress,
+                "created_at": j.created_at,
+            }
+            for j in page
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 @app.get("/api/download/{job_id}")
 async def download_output(job_id: str):
-    job = jobs.get(job_id)
+    job = job_store.get(job_id)
     if not job or not job.output_path:
         return {"error": "No output available"}
     path = Path(job.output_path)
@@ -105,7 +453,7 @@ async def download_output(job_id: str):
 @app.get("/api/thumbnail/{job_id}")
 async def get_thumbnail(job_id: str):
     """Download or preview the generated thumbnail."""
-    job = jobs.get(job_id)
+    job = job_store.get(job_id)
     if not job or not job.thumbnail_path or job.thumbnail_path.startswith("Error"):
         return {"error": "No thumbnail available"}
     path = Path(job.thumbnail_path)
@@ -121,4 +469,5 @@ async def config_status():
         "pexels": bool(settings.pexels_api_key),
         "telegram": bool(settings.telegram_bot_token and settings.telegram_chat_id),
         "fal": bool(settings.fal_key),
+        "youtube": bool(settings.youtube_client_id and token_file().exists()),
     }
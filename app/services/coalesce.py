@@ -0,0 +1,38 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class Coalescer:
+    """Runs concurrent requests for the same key in this process as one task.
+
+    The task is shared by every caller waiting on it and cancelled (which
+    kills its ffmpeg/download) once the last of them is cancelled, so work
+    never outlives the jobs, and the scheduler slots, it was started for.
+    """
+
+    def __init__(self):
+        self._tasks: dict[Hashable, list] = {}  # key -> [task, waiters]
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        entry = self._tasks.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(factory()), 0]
+            self._tasks[key] = entry
+            entry[0].add_done_callback(lambda _t: self._forget(key, entry))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if not entry[1] and not task.done():
+                # Last waiter gone: later callers start afresh
+                self._forget(key, entry)
+                task.cancel()
+                await asyncio.wait({task})
+
+    def _forget(self, key: Hashable, entry: list):
+        if self._tasks.get(key) is entry:
+            del self._tasks[key]
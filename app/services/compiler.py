@@ -1,8 +1,14 @@
 import asyncio
+import math
+import os
+import time
 import uuid
 from pathlib import Path
 
 from app.config import settings
+from app.services.encoding import MEZZ_ENCODE_ARGS, SCALE_PAD_FILTER
+from app.services.ffmpeg import ProgressCallback, run_ffmpeg
+from app.services.probe import MediaInfo, probe, probe_many
 
 
 def _find_font() -> str:
@@ -21,44 +27,17 @@ def _find_font() -> str:
 
 async def get_audio_duration(audio_path: Path) -> float:
     """Get duration of audio file in seconds."""
-    cmd = [
-        "ffprobe", "-v", "quiet", "-nostdin",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        str(audio_path),
-    ]
-    proc = await asyncio.create_subprocess_exec(
-        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    try:
-        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=30)
-    except asyncio.TimeoutError:
-        proc.kill()
-        raise RuntimeError("ffprobe timed out")
-    return float(stdout.decode().strip())
+    return (await probe(audio_path)).duration
 
 
 async def get_video_duration(video_path: Path) -> float:
     """Get duration of video file in seconds."""
-    cmd = [
-        "ffprobe", "-v", "quiet", "-nostdin",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        str(video_path),
-    ]
-    proc = await asyncio.create_subprocess_exec(
-        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    try:
-        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=30)
-    except asyncio.TimeoutError:
-        proc.kill()
-        raise RuntimeError(f"ffprobe timed out for video: {video_path.name}")
+    return (await probe(video_path)).duration
+
 
-    raw = stdout.decode().strip()
-    if not raw:
-        raise RuntimeError(f"Could not read duration for video: {video_path.name}")
-    return float(raw)
+def _matches_output_format(info: MediaInfo) -> bool:
+    """True if a clip is already 1920x1080 @ 30 fps and needs no scale/pad."""
+    return info.width == 1920 and info.height == 1080 and round(info.fps) == 30
 
 
 def _escape_concat_path(path: Path) -> str:
@@ -66,6 +45,10 @@ def _escape_concat_path(path: Path) -> str:
     return str(path).replace("\\", "\\\\").replace("'", "'\\''")
 
 
+def _write_concat_list(list_path: Path, videos: list[Path]):
+    list_path.write_text("\n".join(f"file '{_escape_concat_path(v)}'" for v in videos))
+
+
 def _escape_drawtext(text: str) -> str:
     """Escape title text for FFmpeg drawtext filter."""
     escaped = text.replace("\\", r"\\")
@@ -74,15 +57,59 @@ def _escape_drawtext(text: str) -> str:
     return escaped
 
 
+# The title overlay is drawn for 0 <= t <= TITLE_SECONDS
+TITLE_SECONDS = 8
+
+
+def _title_filter(title: str) -> str:
+    """Build the drawtext filter suffix for the title overlay (empty if no title/font)."""
+    if not title:
+        return ""
+    font_path = _find_font()
+    if not font_path:
+        return ""
+    safe_title = _escape_drawtext(title)
+    return (
+        f",drawtext=text='{safe_title}'"
+        f":fontsize=42:fontcolor=white:borderw=3:bordercolor=black"
+        f":x=(w-text_w)/2:y=50"
+        f":enable='between(t,0,{TITLE_SECONDS})'"
+        f":fontfile={font_path}"
+    )
+
+
 async def compile_video(
     audio_path: Path,
     stock_videos: list[Path],
     title: str = "",
+    normalized: bool = False,
+    audio_filter: str = "",
+    on_progress: ProgressCallback | None = None,
+    report: dict | None = None,
+    gop_seconds: float = 0.0,
 ) -> Path:
     """Compile stock videos with audio into a single Dhamma video.
 
     Strategy: loop and concatenate stock clips to match audio duration,
-    add a title overlay, and mux with the enhanced audio.
+    add a title overlay, and mux with the enhanced audio. By default this is
+    a single FFmpeg encode; set ``COMPILE_MODE=two_pass`` for the legacy
+    visual-intermediate path.
+
+    ``normalized`` means every clip is already a uniform mezzanine (see
+    ``app.services.mezzanine``): the scale/pad chain is skipped, and without
+    a title the visual track is stream-copied through the concat demuxer
+    (in every compile mode but ``two_pass``).
+
+    ``audio_filter`` is applied to the audio inside the same FFmpeg graph
+    (used to fuse enhancement into the mux so no enhanced file is written).
+    ``on_progress`` receives the encoded fraction of the audio duration.
+    With ``COMPILE_MODE=segmented`` the visual track is encoded as parallel
+    segments; pass a dict as ``report`` to receive the per-segment timings.
+
+    ``gop_seconds`` is the keyframe interval of normalized clips. When it is
+    set and a title is drawn (and ``TITLE_WINDOW`` is on), only the first
+    keyframe-aligned window covering the title is re-encoded; the rest of
+    the visual track is stream-copied, whatever ``COMPILE_MODE`` is.
     """
     settings.ensure_dirs()
     job_id = uuid.uuid4().hex[:8]
@@ -96,11 +123,11 @@ async def compile_video(
         names = ", ".join(v.name for v in missing)
         raise FileNotFoundError(f"Stock video files not found: {names}")
 
-    audio_duration = await get_audio_duration(audio_path)
+    audio_info, *clip_infos = await probe_many([audio_path, *stock_videos])
+    audio_duration = audio_info.duration
 
     # Step 1: Create concat list - repeat videos to fill audio duration
     concat_list_path = settings.video_dir / f"{job_id}_concat.txt"
-    intermediate_path = settings.video_dir / f"{job_id}_visual.mp4"
     output_path = settings.output_dir / f"{job_id}_dhamma.mp4"
 
     # Build concat entries — repeat stock clips based on real clip duration.
@@ -109,82 +136,398 @@ async def compile_video(
     if not stock_videos:
         raise RuntimeError("No stock videos available for compilation")
 
-    clip_durations = []
-    for video in stock_videos:
-        clip_durations.append((video, await get_video_duration(video)))
+    clip_durations = [(video, info.duration) for video, info in zip(stock_videos, clip_infos)]
+    if not normalized and all(_matches_output_format(i) for i in clip_infos):
+        scale_filter = "setsar=1"
+    else:
+        scale_filter = SCALE_PAD_FILTER
 
-    entries = []
+    plan = []
     total_est = 0.0
     idx = 0
     while total_est < audio_duration + 10:
         video, duration = clip_durations[idx % len(clip_durations)]
-        entries.append(f"file '{_escape_concat_path(video)}'")
+        plan.append((video, duration))
         total_est += duration
         idx += 1
 
-    concat_list_path.write_text("\n".join(entries))
+    _write_concat_list(concat_list_path, [video for video, _ in plan])
+
+    has_title = bool(_title_filter(title))
+    use_title_window = (
+        normalized
+        and has_title
+        and gop_seconds > 0
+        and settings.title_window
+        and _title_window(gop_seconds) < audio_duration
+    )
 
-    # Step 2: Concatenate and normalize video clips to 1080p
+    try:
+        if use_title_window:
+            await _compile_title_window(
+                plan, audio_path, audio_duration, title, output_path, job_id,
+                gop_seconds=gop_seconds, audio_filter=audio_filter,
+                on_progress=on_progress, report=report,
+            )
+        elif settings.compile_mode == "segmented" and (has_title or not normalized):
+            await _compile_segmented(
+                plan, audio_path, audio_duration, title, output_path, job_id,
+                normalized=normalized, scale_filter=scale_filter, audio_filter=audio_filter,
+                on_progress=on_progress, report=report,
+            )
+        elif settings.compile_mode == "two_pass":
+            await _compile_two_pass(
+                concat_list_path, audio_path, audio_duration, title, output_path, job_id,
+                normalized=normalized, scale_filter=scale_filter, audio_filter=audio_filter,
+                on_progress=on_progress,
+            )
+        else:
+            await _compile_single_pass(
+                concat_list_path, audio_path, audio_duration, title, output_path,
+                normalized=normalized, scale_filter=scale_filter, audio_filter=audio_filter,
+                on_progress=on_progress,
+            )
+    except BaseException:
+        # Failed or cancelled: don't leave a truncated MP4 behind
+        output_path.unlink(missing_ok=True)
+        raise
+    finally:
+        concat_list_path.unlink(missing_ok=True)
+
+    return output_path
+
+
+async def _compile_single_pass(
+    concat_list_path: Path,
+    audio_path: Path,
+    audio_duration: float,
+    title: str,
+    output_path: Path,
+    normalized: bool = False,
+    scale_filter: str = SCALE_PAD_FILTER,
+    audio_filter: str = "",
+    on_progress: ProgressCallback | None = None,
+) -> None:
+    """Concat, normalize, overlay the title and mux audio in one encode."""
+    title_filter = _title_filter(title)
+    graph = []
+    if normalized and not title_filter:
+        video_args = ["-map", "0:v:0", "-c:v", "copy"]
+    else:
+        base = "null" if normalized else f"{scale_filter},fps=30"
+        graph.append(f"[0:v]{base}{title_filter}[v]")
+        video_args = [
+            "-map", "[v]",
+            "-c:v", "libx264", "-preset", "medium", "-crf", "20",
+        ]
+    if audio_filter:
+        graph.append(f"[1:a:0]{audio_filter}[a]")
+        audio_map = ["-map", "[a]"]
+    else:
+        audio_map = ["-map", "1:a:0"]
+    cmd = [
+        "ffmpeg", "-y", "-nostdin",
+        "-f", "concat", "-safe", "0",
+        "-i", str(concat_list_path),
+        "-i", str(audio_path),
+        *(["-filter_complex", ";".join(graph)] if graph else []),
+        *video_args,
+        *audio_map,
+        "-c:a", "aac", "-b:a", "192k", "-ar", "48000",
+        "-t", str(audio_duration),
+        "-movflags", "+faststart",
+        str(output_path),
+    ]
+    await run_ffmpeg(
+        cmd, timeout=3600, label="Video compile",
+        duration=audio_duration, on_progress=on_progress,
+    )
+
+
+async def _compile_two_pass(
+    concat_list_path: Path,
+    audio_path: Path,
+    audio_duration: float,
+    title: str,
+    output_path: Path,
+    job_id: str,
+    normalized: bool = False,
+    scale_filter: str = SCALE_PAD_FILTER,
+    audio_filter: str = "",
+    on_progress: ProgressCallback | None = None,
+) -> None:
+    """Legacy path: encode a visual intermediate, then re-encode it with title + audio."""
+    intermediate_path = settings.video_dir / f"{job_id}_visual.mp4"
+
+    # Concatenate and normalize video clips to 1080p (stream copy for mezzanines)
+    if normalized:
+        visual_args = ["-c:v", "copy"]
+    else:
+        visual_args = [
+            "-vf", scale_filter,
+            "-c:v", "libx264", "-preset", "medium", "-crf", "20",
+            "-r", "30",
+        ]
     concat_cmd = [
         "ffmpeg", "-y", "-nostdin",
         "-f", "concat", "-safe", "0",
         "-i", str(concat_list_path),
-        "-vf", "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2,setsar=1",
-        "-c:v", "libx264", "-preset", "medium", "-crf", "20",
-        "-r", "30",
+        *visual_args,
         "-an",
         "-t", str(audio_duration),
         str(intermediate_path),
     ]
-    proc = await asyncio.create_subprocess_exec(
-        *concat_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
     try:
-        _, stderr = await asyncio.wait_for(proc.communicate(), timeout=1800)
-    except asyncio.TimeoutError:
-        proc.kill()
-        raise RuntimeError("Video concat timed out after 30 minutes")
-    if proc.returncode != 0:
-        raise RuntimeError(f"Video concat failed: {stderr.decode()}")
-
-    # Step 3: Mux video + audio, add title overlay if provided
-    title_filter = ""
-    if title:
-        font_path = _find_font()
-        if font_path:
-            safe_title = _escape_drawtext(title)
-            title_filter = (
-                f",drawtext=text='{safe_title}'"
-                f":fontsize=42:fontcolor=white:borderw=3:bordercolor=black"
-                f":x=(w-text_w)/2:y=50"
-                f":enable='between(t,0,8)'"
-                f":fontfile={font_path}"
-            )
+        await run_ffmpeg(
+            concat_cmd, timeout=1800, label="Video concat", duration=audio_duration,
+            on_progress=on_progress and (lambda f: on_progress(f / 2)),
+        )
+
+        # Mux video + audio, add title overlay if provided
+        mux_cmd = [
+            "ffmpeg", "-y", "-nostdin",
+            "-i", str(intermediate_path),
+            "-i", str(audio_path),
+            "-vf", f"null{_title_filter(title)}",
+            *(["-af", audio_filter] if audio_filter else []),
+            "-c:v", "libx264", "-preset", "medium", "-crf", "20",
+            "-c:a", "aac", "-b:a", "192k", "-ar", "48000",
+            "-shortest",
+            "-movflags", "+faststart",
+            str(output_path),
+        ]
+        await run_ffmpeg(
+            mux_cmd, timeout=1800, label="Video mux", duration=audio_duration,
+            on_progress=on_progress and (lambda f: on_progress(0.5 + f / 2)),
+        )
+    finally:
+        intermediate_path.unlink(missing_ok=True)
+
+
+def _split_segments(
+    plan: list[tuple[Path, float]], audio_duration: float, target: float
+) -> list[tuple[float, list[Path], float]]:
+    """Split the concat plan on clip boundaries into ~``target``-second segments.
+
+    Returns (start, clips, duration) per segment; the last segment is cut
+    to end exactly at ``audio_duration``.
+    """
+    segments = []
+    start, clips, length = 0.0, [], 0.0
+    for video, duration in plan:
+        if start >= audio_duration:
+            break
+        clips.append(video)
+        length += duration
+        if length >= target or start + length >= audio_duration:
+            segments.append((start, clips, min(length, audio_duration - start)))
+            start, clips, length = start + length, [], 0.0
+    if clips and start < audio_duration:
+        segments.append((start, clips, min(length, audio_duration - start)))
+    return segments
+
+
+async def _compile_segmented(
+    plan: list[tuple[Path, float]],
+    audio_path: Path,
+    audio_duration: float,
+    title: str,
+    output_path: Path,
+    job_id: str,
+    normalized: bool = False,
+    scale_filter: str = SCALE_PAD_FILTER,
+    audio_filter: str = "",
+    on_progress: ProgressCallback | None = None,
+    report: dict | None = None,
+) -> None:
+    """Encode the visual track as parallel segments, then join with stream copy + mux audio."""
+    segments = _split_segments(plan, audio_duration, settings.segment_seconds)
+    workers = max(1, settings.segment_workers)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    sem = asyncio.Semaphore(workers)
+    base = "null" if normalized else f"{scale_filter},fps=30"
+    done = [0.0] * len(segments)
+    timings: list[dict] = []
+    seg_paths = [settings.video_dir / f"{job_id}_seg{i:03d}.mp4" for i in range(len(segments))]
+    join_list_path = settings.video_dir / f"{job_id}_segments.txt"
+
+    def seg_progress(i: int, seg_duration: float):
+        def report_fraction(fraction: float):
+            done[i] = fraction * seg_duration
+            if on_progress:
+                # Segments are ~95% of the work; the join/mux is the rest
+                on_progress(0.95 * sum(done) / audio_duration)
+        return report_fraction
+
+    async def encode(i: int, start: float, clips: list[Path], seg_duration: float):
+        list_path = settings.video_dir / f"{job_id}_seg{i:03d}.txt"
+        _write_concat_list(list_path, clips)
+        # The title is only on screen for t <= 8s, so only the first segment draws it
+        title_filter = _title_filter(title) if i == 0 else ""
+        cmd = [
+            "ffmpeg", "-y", "-nostdin",
+            "-f", "concat", "-safe", "0",
+            "-i", str(list_path),
+            "-vf", f"{base}{title_filter}",
+            *MEZZ_ENCODE_ARGS,
+            "-threads", str(threads),
+            "-r", "30",
+            "-an",
+            "-t", str(seg_duration),
+            str(seg_paths[i]),
+        ]
+        async with sem:
+            began = time.monotonic()
+            try:
+                await run_ffmpeg(
+                    cmd, timeout=3600, label=f"Segment {i} encode",
+                    duration=seg_duration, on_progress=seg_progress(i, seg_duration),
+                )
+            finally:
+                list_path.unlink(missing_ok=True)
+            timings.append({
+                "index": i,
+                "start": round(start, 3),
+                "duration": round(seg_duration, 3),
+                "seconds": round(time.monotonic() - began, 3),
+            })
+
+    try:
+        await asyncio.gather(*(
+            encode(i, start, clips, seg_duration)
+            for i, (start, clips, seg_duration) in enumerate(segments)
+        ))
+
+        _write_concat_list(join_list_path, seg_paths)
+        cmd = [
+            "ffmpeg", "-y", "-nostdin",
+            "-f", "concat", "-safe", "0",
+            "-i", str(join_list_path),
+            "-i", str(audio_path),
+            *(["-filter_complex", f"[1:a:0]{audio_filter}[a]"] if audio_filter else []),
+            "-map", "0:v:0", "-c:v", "copy",
+            "-map", "[a]" if audio_filter else "1:a:0",
+            "-c:a", "aac", "-b:a", "192k", "-ar", "48000",
+            "-t", str(audio_duration),
+            "-movflags", "+faststart",
+            str(output_path),
+        ]
+        began = time.monotonic()
+        await run_ffmpeg(
+            cmd, timeout=1800, label="Segment join",
+            duration=audio_duration,
+            on_progress=on_progress and (lambda f: on_progress(0.95 + 0.05 * f)),
+        )
+        join_seconds = time.monotonic() - began
+    finally:
+        join_list_path.unlink(missing_ok=True)
+        for path in seg_paths:
+            path.unlink(missing_ok=True)
 
-    mux_cmd = [
+    if report is not None:
+        report["mode"] = "segmented"
+        report["workers"] = workers
+        report["segments"] = sorted(timings, key=lambda t: t["index"])
+        report["join_seconds"] = round(join_seconds, 3)
+
+
+def _title_window(gop_seconds: float) -> float:
+    """First GOP boundary strictly after the title's last frame (t = TITLE_SECONDS)."""
+    return (math.floor(TITLE_SECONDS / gop_seconds) + 1) * gop_seconds
+
+
+async def _compile_title_window(
+    plan: list[tuple[Path, float]],
+    audio_path: Path,
+    audio_duration: float,
+    title: str,
+    output_path: Path,
+    job_id: str,
+    gop_seconds: float,
+    audio_filter: str = "",
+    on_progress: ProgressCallback | None = None,
+    report: dict | None = None,
+) -> None:
+    """Re-encode only the title window, stream-copy the rest of the visual track.
+
+    Normalized clips are whole GOPs long, so every multiple of
+    ``gop_seconds`` on the joined timeline is a keyframe. The head (0 to the
+    first boundary after the title) is encoded with the same parameters as
+    the clips; the tail joins at that keyframe via a concat ``inpoint``.
+    """
+    window = _title_window(gop_seconds)
+    head_path = settings.video_dir / f"{job_id}_head.mp4"
+    head_list_path = settings.video_dir / f"{job_id}_head.txt"
+    join_list_path = settings.video_dir / f"{job_id}_join.txt"
+
+    # Find the clip the window ends in and how far into it the tail starts
+    start = 0.0
+    for split, (_, duration) in enumerate(plan):
+        if start + duration > window:
+            break
+        start += duration
+    head_clips = [video for video, _ in plan[: split + 1]]
+    inpoint = round(window - start, 6)
+
+    # Head share of the progress bar, by duration
+    head_share = window / audio_duration
+
+    _write_concat_list(head_list_path, head_clips)
+    head_cmd = [
         "ffmpeg", "-y", "-nostdin",
-        "-i", str(intermediate_path),
-        "-i", str(audio_path),
-        "-vf", f"null{title_filter}",
-        "-c:v", "libx264", "-preset", "medium", "-crf", "20",
-        "-c:a", "aac", "-b:a", "192k", "-ar", "48000",
-        "-shortest",
-        "-movflags", "+faststart",
-        str(output_path),
+        "-f", "concat", "-safe", "0",
+        "-i", str(head_list_path),
+        "-vf", f"null{_title_filter(title)}",
+        *MEZZ_ENCODE_ARGS,
+        "-r", "30",
+        "-an",
+        "-t", str(window),
+        str(head_path),
     ]
-    proc = await asyncio.create_subprocess_exec(
-        *mux_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
+
+    join_lines = [f"file '{_escape_concat_path(head_path)}'"]
+    tail_clip = plan[split][0]
+    join_lines.append(f"file '{_escape_concat_path(tail_clip)}'")
+    if inpoint > 0:
+        join_lines.append(f"inpoint {inpoint}")
+    join_lines += [f"file '{_escape_concat_path(video)}'" for video, _ in plan[split + 1:]]
+    join_list_path.write_text("\n".join(join_lines))
+
     try:
-        _, stderr = await asyncio.wait_for(proc.communicate(), timeout=1800)
-    except asyncio.TimeoutError:
-        proc.kill()
-        raise RuntimeError("Video mux timed out after 30 minutes")
-    if proc.returncode != 0:
-        raise RuntimeError(f"Video mux failed: {stderr.decode()}")
+        began = time.monotonic()
+        await run_ffmpeg(
+            head_cmd, timeout=600, label="Title window encode", duration=window,
+            on_progress=on_progress and (lambda f: on_progress(head_share * f)),
+        )
+        head_seconds = time.monotonic() - began
 
-    # Cleanup intermediate files
-    concat_list_path.unlink(missing_ok=True)
-    intermediate_path.unlink(missing_ok=True)
+        cmd = [
+            "ffmpeg", "-y", "-nostdin",
+            "-f", "concat", "-safe", "0",
+            "-i", str(join_list_path),
+            "-i", str(audio_path),
+            *(["-filter_complex", f"[1:a:0]{audio_filter}[a]"] if audio_filter else []),
+            "-map", "0:v:0", "-c:v", "copy",
+            "-map", "[a]" if audio_filter else "1:a:0",
+            "-c:a", "aac", "-b:a", "192k", "-ar", "48000",
+            "-t", str(audio_duration),
+            "-movflags", "+faststart",
+            str(output_path),
+        ]
+        began = time.monotonic()
+        await run_ffmpeg(
+            cmd, timeout=1800, label="Title window join", duration=audio_duration,
+            on_progress=on_progress and (
+                lambda f: on_progress(head_share + (1 - head_share) * f)
+            ),
+        )
+        join_seconds = time.monotonic() - began
+    finally:
+        for path in (head_list_path, join_list_path, head_path):
+            path.unlink(missing_ok=True)
 
-    return output_path
+    if report is not None:
+        report["mode"] = "title_window"
+        report["window"] = round(window, 3)
+        report["head_seconds"] = round(head_seconds, 3)
+        report["join_seconds"] = round(join_seconds, 3)
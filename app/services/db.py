@@ -0,0 +1,44 @@
+import sqlite3
+from contextlib import contextmanager
+
+from app.config import settings
+
+_conn: sqlite3.Connection | None = None
+_schemas: set[str] = set()
+
+
+def connect(path) -> sqlite3.Connection:
+    """Open a SQLite connection suitable for sharing between uvicorn workers."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def get_conn(schema: str = "") -> sqlite3.Connection:
+    """Return the process-wide connection to ``settings.db_path``.
+
+    ``schema`` is applied once per process, so each module can own its tables.
+    """
+    global _conn
+    if _conn is None:
+        _conn = connect(settings.db_path)
+    if schema and schema not in _schemas:
+        _conn.executescript(schema)
+        _schemas.add(schema)
+    return _conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """Write transaction that takes the database lock up front."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
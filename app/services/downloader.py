@@ -1,55 +1,385 @@
 import asyncio
-import httpx
+import hashlib
+import json
 import uuid
 from pathlib import Path
-from urllib.parse import urlparse
+from typing import AsyncIterator
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
 from app.config import settings
+from app.services.db import get_conn
+from app.services.enhancer import enhance_audio, enhance_stream, enhanced_audio
+from app.services.ffmpeg import ProgressCallback, kill_process, run_process, start_process
+from app.services.filecache import FileCache
+from app.services.http import get_client
 
+# Downloaded source audio, keyed by SHA-256 of its bytes
+source_audio = FileCache("source_audio", lambda: settings.audio_cache_bytes)
 
-async def download_audio(url: str) -> Path:
-    """Download audio from URL. Supports direct links and yt-dlp sources."""
+# Maps normalized URLs and extractor video ids to a source content hash
+ALIAS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS source_aliases (
+    alias TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL
+);
+"""
+
+TRACKING_PARAMS = {"si", "feature", "fbclid", "gclid", "ref"}
+HASH_CHUNK = 1024 * 1024
+STREAM_CHUNK = 256 * 1024
+
+# Direct links FFmpeg can demux from a pipe (an .m4a may keep its index at the end)
+STREAM_EXTENSIONS = (".mp3", ".wav", ".ogg", ".flac")
+
+# Leading bytes of the containers yt-dlp may stream, to name a kept source file
+MAGIC_EXTENSIONS = (
+    (b"\x1a\x45\xdf\xa3", ".webm"),
+    (b"OggS", ".ogg"),
+    (b"fLaC", ".flac"),
+    (b"RIFF", ".wav"),
+    (b"ID3", ".mp3"),
+)
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for dedupe: lower-case host, no fragment or tracking params."""
+    parsed = urlparse(url.strip())
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parsed.query)
+        if k not in TRACKING_PARAMS and not k.startswith("utm_")
+    )
+    return urlunparse((
+        parsed.scheme.lower(), parsed.netloc.lower(), parsed.path.rstrip("/") or "/",
+        "", urlencode(query), "",
+    ))
+
+
+def is_direct_link(url: str) -> bool:
+    path = urlparse(url).path
+    return any(path.endswith(ext) for ext in (".mp3", ".wav", ".m4a", ".ogg", ".flac"))
+
+
+def _ytdlp_cmd(*args: str) -> list[str]:
+    """yt-dlp command sharing the persistent cache directory."""
+    return ["yt-dlp", "--cache-dir", str(settings.ytdlp_cache_dir), *args]
+
+
+def _ytdlp_download_args() -> list[str]:
+    """Format selection for audio downloads.
+
+    Fast ingest keeps the source's own codec (the enhancer and compiler
+    read it directly) and fetches fragments concurrently; otherwise the
+    audio is converted to WAV.
+    """
+    if settings.ytdlp_fast_ingest:
+        return [
+            "-f", "bestaudio/best",
+            "--concurrent-fragments", str(settings.ytdlp_concurrent_fragments),
+        ]
+    return ["--extract-audio", "--audio-format", "wav", "--audio-quality", "0"]
+
+
+def _lookup_alias(alias: str) -> str | None:
+    row = get_conn(ALIAS_SCHEMA).execute(
+        "SELECT content_hash FROM source_aliases WHERE alias = ?", (alias,)
+    ).fetchone()
+    return row["content_hash"] if row else None
+
+
+def _record_aliases(aliases: list[str], content_hash: str):
+    conn = get_conn(ALIAS_SCHEMA)
+    for alias in aliases:
+        conn.execute(
+            "INSERT INTO source_aliases (alias, content_hash) VALUES (?, ?) "
+            "ON CONFLICT(alias) DO UPDATE SET content_hash=excluded.content_hash",
+            (alias, content_hash),
+        )
+
+
+def _cached_source(aliases: list[str], owner: str) -> Path | None:
+    for alias in aliases:
+        content_hash = _lookup_alias(alias)
+        if content_hash:
+            entry = source_audio.get(content_hash, owner=owner)
+            if entry:
+                return entry.path
+    return None
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _extractor_id(url: str) -> str | None:
+    """Resolve ``extractor:id`` for a yt-dlp URL without downloading media."""
+    cmd = _ytdlp_cmd(
+        "--simulate", "--no-playlist", "--no-warnings",
+        "--print", "%(extractor_key)s:%(id)s",
+        url,
+    )
+    try:
+        returncode, stdout, _ = await run_process(cmd, timeout=60)
+    except asyncio.TimeoutError:
+        return None
+    if returncode != 0:
+        return None
+    lines = stdout.decode().strip().splitlines()
+    return f"ytdl:{lines[0]}" if lines else None
+
+
+async def expand_playlist(url: str) -> list[tuple[str, str]]:
+    """List a playlist's entries as (url, title) using yt-dlp flat extraction.
+
+    Nothing is downloaded. A URL that is not a playlist yields itself.
+    """
+    cmd = _ytdlp_cmd("--flat-playlist", "-J", "--no-warnings", url)
+    try:
+        returncode, stdout, stderr = await run_process(cmd, timeout=300)
+    except asyncio.TimeoutError:
+        raise RuntimeError("yt-dlp playlist listing timed out after 5 minutes")
+    if returncode != 0:
+        raise RuntimeError(f"yt-dlp failed: {stderr.decode()}")
+    info = json.loads(stdout.decode() or "{}")
+    if "entries" not in info:
+        return [(info.get("webpage_url") or url, info.get("title", ""))]
+    entries = []
+    for entry in info["entries"] or []:
+        link = entry.get("webpage_url") or entry.get("url")
+        if link and "://" in link:
+            entries.append((link, entry.get("title") or ""))
+    return entries
+
+
+def _adopt(tmp_path: Path, content_hash: str, aliases: list[str], owner: str) -> Path:
+    """Move a fresh download into the source cache, or reuse an identical cached file."""
+    _record_aliases(aliases, content_hash)
+    entry = source_audio.get(content_hash, owner=owner)
+    if entry:
+        # Same bytes under a different URL: keep the copy we already have
+        tmp_path.unlink(missing_ok=True)
+        return entry.path
+    out_path = settings.audio_dir / f"{content_hash[:16]}_raw{tmp_path.suffix}"
+    tmp_path.replace(out_path)
+    source_audio.put(content_hash, out_path, owner=owner)
+    return out_path
+
+
+async def download_audio(url: str, owner: str = "") -> Path:
+    """Download audio from URL. Supports direct links and yt-dlp sources.
+
+    yt-dlp sources are kept in their native codec (opus/m4a) with
+    ``YTDLP_FAST_INGEST``, and converted to WAV otherwise.
+
+    Downloads are deduplicated: a URL (normalized) or extractor video id seen
+    before, or new bytes identical to a cached file, reuse the cached source.
+    The returned file is referenced by ``owner``; release it with
+    ``source_audio.release_owner(owner)`` instead of deleting it.
+    """
     settings.ensure_dirs()
+    owner = owner or uuid.uuid4().hex[:8]
     job_id = uuid.uuid4().hex[:8]
+    aliases = [f"url:{normalize_url(url)}"]
 
-    parsed = urlparse(url)
+    cached = _cached_source(aliases, owner)
+    if cached:
+        return cached
 
     # Direct audio file link
-    if any(parsed.path.endswith(ext) for ext in (".mp3", ".wav", ".m4a", ".ogg", ".flac")):
-        ext = Path(parsed.path).suffix
-        out_path = settings.audio_dir / f"{job_id}_raw{ext}"
-        async with httpx.AsyncClient(follow_redirects=True, timeout=300) as client:
-            async with client.stream("GET", url) as resp:
+    if is_direct_link(url):
+        ext = Path(urlparse(url).path).suffix
+        tmp_path = settings.audio_dir / f"{job_id}_download{ext}"
+        digest = hashlib.sha256()
+        try:
+            async with get_client().stream("GET", url, timeout=300) as resp:
                 resp.raise_for_status()
-                with open(out_path, "wb") as f:
-                    async for chunk in resp.aiter_bytes(8192):
+                with open(tmp_path, "wb") as f:
+                    async for chunk in resp.aiter_bytes(STREAM_CHUNK):
+                        digest.update(chunk)
                         f.write(chunk)
-        return out_path
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return _adopt(tmp_path, digest.hexdigest(), aliases, owner)
+
+    # Same talk under another URL (e.g. youtu.be vs youtube.com/watch)
+    video_id = await _extractor_id(url)
+    if video_id:
+        aliases.append(video_id)
+        content_hash = _lookup_alias(video_id)
+        entry = source_audio.get(content_hash, owner=owner) if content_hash else None
+        if entry:
+            _record_aliases(aliases, content_hash)
+            return entry.path
 
     # Use yt-dlp for other URLs (YouTube, SoundCloud, etc.)
-    out_template = str(settings.audio_dir / f"{job_id}_raw.%(ext)s")
-    cmd = [
-        "yt-dlp",
-        "--extract-audio",
-        "--audio-format", "wav",
-        "--audio-quality", "0",
+    out_template = str(settings.audio_dir / f"{job_id}_download.%(ext)s")
+    cmd = _ytdlp_cmd(
+        *_ytdlp_download_args(),
         "--output", out_template,
         "--no-playlist",
         url,
-    ]
-    proc = await asyncio.create_subprocess_exec(
-        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
     try:
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=600)
-    except asyncio.TimeoutError:
-        proc.kill()
-        raise RuntimeError("yt-dlp download timed out after 10 minutes")
-    if proc.returncode != 0:
-        raise RuntimeError(f"yt-dlp failed: {stderr.decode()}")
+        returncode, _, stderr = await run_process(cmd, timeout=600)
+        if returncode != 0:
+            raise RuntimeError(f"yt-dlp failed: {stderr.decode()}")
+    except BaseException as e:
+        # Drop partial downloads and yt-dlp's intermediate files
+        for f in settings.audio_dir.glob(f"{job_id}_download*"):
+            f.unlink(missing_ok=True)
+        if isinstance(e, asyncio.TimeoutError):
+            raise RuntimeError("yt-dlp download timed out after 10 minutes")
+        raise
 
     # Find the downloaded file
-    for f in settings.audio_dir.glob(f"{job_id}_raw.*"):
-        return f
+    for f in settings.audio_dir.glob(f"{job_id}_download.*"):
+        content_hash = await asyncio.to_thread(_sha256_file, f)
+        return _adopt(f, content_hash, aliases, owner)
 
     raise FileNotFoundError("Downloaded audio file not found")
+
+
+def can_stream(url: str) -> bool:
+    """True if ``url`` can be enhanced while downloading (see ``download_enhanced``)."""
+    if is_direct_link(url):
+        return Path(urlparse(url).path).suffix.lower() in STREAM_EXTENSIONS
+    return True
+
+
+def _sniff_extension(head: bytes) -> str:
+    for magic, ext in MAGIC_EXTENSIONS:
+        if head.startswith(magic):
+            return ext
+    if head[4:8] == b"ftyp":
+        return ".m4a"
+    return ".mp3" if head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2") else ".bin"
+
+
+async def _http_chunks(url: str, on_progress: ProgressCallback | None) -> AsyncIterator[bytes]:
+    async with get_client().stream("GET", url, timeout=300) as resp:
+        resp.raise_for_status()
+        total = int(resp.headers.get("content-length") or 0)
+        received = 0
+        async for chunk in resp.aiter_bytes(STREAM_CHUNK):
+            received += len(chunk)
+            if on_progress and total:
+                on_progress(min(1.0, received / total))
+            yield chunk
+
+
+async def _ytdlp_chunks(url: str) -> AsyncIterator[bytes]:
+    """Bytes of the best audio format, as yt-dlp writes them to stdout."""
+    cmd = _ytdlp_cmd(
+        "-f", "bestaudio/best",
+        "--concurrent-fragments", str(settings.ytdlp_concurrent_fragments),
+        "--no-playlist", "--quiet", "--no-warnings",
+        "--output", "-", url,
+    )
+    proc = await start_process(cmd)
+    stderr = bytearray()
+
+    async def read_stderr():
+        while chunk := await proc.stderr.read(8192):
+            stderr.extend(chunk)
+
+    reader = asyncio.create_task(read_stderr())
+    try:
+        while chunk := await proc.stdout.read(STREAM_CHUNK):
+            yield chunk
+        await reader
+        if await proc.wait() != 0:
+            raise RuntimeError(f"yt-dlp failed: {stderr.decode(errors='replace')}")
+    finally:
+        reader.cancel()
+        # A full, unread stdout pipe would keep the killed process from being reaped
+        drain = asyncio.ensure_future(proc.stdout.read())
+        await kill_process(proc)
+        drain.cancel()
+
+
+async def download_enhanced(
+    url: str,
+    owner: str = "",
+    on_progress: ProgressCallback | None = None,
+) -> Path:
+    """Download ``url`` and enhance it in one pass, returning the enhanced FLAC.
+
+    The download (httpx for direct links, ``yt-dlp -o -`` otherwise) is
+    piped into the enhancer's FFmpeg as it arrives, so enhancement overlaps
+    the transfer. The raw bytes are only written to disk, into the source
+    cache, with ``STREAM_KEEP_SOURCE``. Both files are deduplicated like
+    ``download_audio``'s and referenced by ``owner``.
+    """
+    settings.ensure_dirs()
+    owner = owner or uuid.uuid4().hex[:8]
+    aliases = [f"url:{normalize_url(url)}"]
+    direct = is_direct_link(url)
+    if not direct:
+        video_id = await _extractor_id(url)
+        if video_id:
+            aliases.append(video_id)
+
+    # Seen before: reuse the enhanced file, or enhance the cached source
+    for alias in aliases:
+        content_hash = _lookup_alias(alias)
+        if not content_hash:
+            continue
+        entry = enhanced_audio.get(f"{content_hash[:16]}.flac", owner=owner)
+        if entry:
+            _record_aliases(aliases, content_hash)
+            return entry.path
+        source = source_audio.get(content_hash, owner=owner)
+        if source:
+            _record_aliases(aliases, content_hash)
+            return await enhance_audio(source.path, owner=owner, on_progress=on_progress)
+
+    tag = uuid.uuid4().hex[:8]
+    raw_path = settings.audio_dir / f"{tag}_download"
+    part_path = settings.audio_dir / f"{tag}_enhanced.part.flac"
+    digest = hashlib.sha256()
+    raw = open(raw_path, "wb") if settings.stream_keep_source else None
+    head = b""
+    chunks = _http_chunks(url, on_progress) if direct else _ytdlp_chunks(url)
+
+    async def tee():
+        nonlocal head
+        async for chunk in chunks:
+            if len(head) < 16:
+                head += chunk[:16]
+            digest.update(chunk)
+            if raw:
+                raw.write(chunk)
+            yield chunk
+
+    try:
+        await enhance_stream(tee(), part_path)
+    except BaseException:
+        raw_path.unlink(missing_ok=True)
+        raise
+    finally:
+        await chunks.aclose()
+        if raw:
+            raw.close()
+
+    content_hash = digest.hexdigest()
+    if raw:
+        ext = Path(urlparse(url).path).suffix if direct else _sniff_extension(head)
+        kept = raw_path.with_name(f"{raw_path.name}{ext}")
+        raw_path.replace(kept)
+        _adopt(kept, content_hash, aliases, owner)
+    else:
+        _record_aliases(aliases, content_hash)
+
+    stem = content_hash[:16]
+    entry = enhanced_audio.get(f"{stem}.flac", owner=owner)
+    if entry:
+        part_path.unlink(missing_ok=True)
+        return entry.path
+    output_path = settings.audio_dir / f"{stem}_enhanced.flac"
+    part_path.replace(output_path)
+    enhanced_audio.put(f"{stem}.flac", output_path, owner=owner)
+    return output_path
@@ -0,0 +1,21 @@
+# Uniform mezzanine format, shared by normalized stock clips and the
+# segments the compiler encodes. Every encode shares codec, resolution,
+# frame rate, GOP and timebase, so independently encoded files can be
+# joined with the concat demuxer and `-c copy`.
+MEZZ_WIDTH = 1920
+MEZZ_HEIGHT = 1080
+MEZZ_FPS = 30
+MEZZ_GOP = 60
+MEZZ_TIMESCALE = 15360
+
+MEZZ_ENCODE_ARGS = [
+    "-c:v", "libx264", "-preset", "medium", "-crf", "20",
+    "-pix_fmt", "yuv420p", "-profile:v", "high",
+    "-g", str(MEZZ_GOP), "-keyint_min", str(MEZZ_GOP), "-sc_threshold", "0",
+    "-video_track_timescale", str(MEZZ_TIMESCALE),
+]
+
+SCALE_PAD_FILTER = (
+    f"scale={MEZZ_WIDTH}:{MEZZ_HEIGHT}:force_original_aspect_ratio=decrease,"
+    f"pad={MEZZ_WIDTH}:{MEZZ_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+)
@@ -1,50 +1,113 @@
-import asyncio
+import uuid
 from pathlib import Path
+from typing import AsyncIterator
 
 from app.config import settings
+from app.services.coalesce import Coalescer
+from app.services.ffmpeg import ProgressCallback, pipe_ffmpeg, run_ffmpeg
+from app.services.filecache import FileCache
+from app.services.probe import probe
 
+# FFmpeg filter chain:
+# 1. highpass: remove low rumble below 80Hz
+# 2. lowpass: cut harsh highs above 14kHz (speech focus)
+# 3. afftdn: adaptive noise reduction
+# 4. acompressor: gentle compression for consistent volume
+# 5. loudnorm: EBU R128 loudness normalization to -16 LUFS
+# 6. aresample: resample to 48kHz studio quality
+ENHANCE_FILTERS = (
+    "highpass=f=80,"
+    "lowpass=f=14000,"
+    "afftdn=nf=-25:nr=10:nt=w,"
+    "acompressor=threshold=-20dB:ratio=3:attack=5:release=50,"
+    "loudnorm=I=-16:TP=-1.5:LRA=11,"
+    "aresample=48000"
+)
 
-async def enhance_audio(input_path: Path) -> Path:
-    """Enhance Dhamma audio: normalize loudness, reduce noise, output studio WAV."""
-    settings.ensure_dirs()
-    stem = input_path.stem.replace("_raw", "")
-    output_path = settings.audio_dir / f"{stem}_enhanced.wav"
-
-    # FFmpeg filter chain:
-    # 1. highpass: remove low rumble below 80Hz
-    # 2. lowpass: cut harsh highs above 14kHz (speech focus)
-    # 3. afftdn: adaptive noise reduction
-    # 4. acompressor: gentle compression for consistent volume
-    # 5. loudnorm: EBU R128 loudness normalization to -16 LUFS
-    # 6. aresample: resample to 48kHz studio quality
-    filters = (
-        "highpass=f=80,"
-        "lowpass=f=14000,"
-        "afftdn=nf=-25:nr=10:nt=w,"
-        "acompressor=threshold=-20dB:ratio=3:attack=5:release=50,"
-        "loudnorm=I=-16:TP=-1.5:LRA=11,"
-        "aresample=48000"
-    )
-
-    cmd = [
+# Enhanced audio, keyed by the source file stem (content-hash based for cached sources)
+enhanced_audio = FileCache("enhanced_audio", lambda: settings.audio_cache_bytes)
+
+# Enhancements in progress by source stem; repeat submissions of the same talk
+# in this process wait for the one encode
+_encodes = Coalescer()
+
+
+def _enhance_cmd(input_arg: str, output_path: Path) -> list[str]:
+    return [
         "ffmpeg", "-y",
-        "-i", str(input_path),
-        "-af", filters,
+        "-i", input_arg,
+        # The "bestaudio/best" download fallback can be a muxed video
+        "-map", "0:a:0",
+        "-af", ENHANCE_FILTERS,
         "-ar", "48000",
         "-sample_fmt", "s16",
-        "-c:a", "pcm_s16le",
+        "-c:a", "flac",
         str(output_path),
     ]
 
-    proc = await asyncio.create_subprocess_exec(
-        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
+
+async def enhance_audio(
+    input_path: Path,
+    owner: str = "",
+    on_progress: ProgressCallback | None = None,
+) -> Path:
+    """Enhance Dhamma audio: normalize loudness, reduce noise, output lossless FLAC.
+
+    With ``FUSE_ENHANCEMENT`` on, the pipeline skips this and applies
+    ``ENHANCE_FILTERS`` inside the compile graph instead. Results are cached,
+    so the same source is only enhanced once; the file is referenced by
+    ``owner`` until ``enhanced_audio.release_owner(owner)``.
+    """
+    settings.ensure_dirs()
+    stem = input_path.stem.replace("_raw", "")
+    entry = enhanced_audio.get(f"{stem}.flac", owner=owner)
+    if entry:
+        return entry.path
+
+    # Referenced before the shared encode registers it, so it can't be
+    # evicted in between; a cancelled job's release drops the reference
+    enhanced_audio.acquire(f"{stem}.flac", owner)
+    return await _encodes.run(stem, lambda: _enhance(input_path, stem, on_progress))
+
+
+async def _enhance(input_path: Path, stem: str, on_progress: ProgressCallback | None) -> Path:
+    output_path = settings.audio_dir / f"{stem}_enhanced.flac"
+    # Unique per attempt, so encodes in other worker processes never share it
+    part_path = output_path.with_suffix(f".{uuid.uuid4().hex[:8]}.part.flac")
+
+    cmd = _enhance_cmd(str(input_path), part_path)
+    duration = (await probe(input_path)).duration if on_progress else 0.0
     try:
-        _, stderr = await asyncio.wait_for(proc.communicate(), timeout=900)
-    except asyncio.TimeoutError:
-        proc.kill()
-        raise RuntimeError("Audio enhancement timed out after 15 minutes")
-    if proc.returncode != 0:
-        raise RuntimeError(f"Audio enhancement failed: {stderr.decode()}")
+        await run_ffmpeg(
+            cmd, timeout=900, label="Audio enhancement",
+            duration=duration, on_progress=on_progress,
+        )
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
 
+    # Another worker process may have enhanced the same source meanwhile
+    entry = enhanced_audio.get(f"{stem}.flac")
+    if entry:
+        part_path.unlink(missing_ok=True)
+        return entry.path
+    part_path.replace(output_path)
+    enhanced_audio.put(f"{stem}.flac", output_path)
     return output_path
+
+
+async def enhance_stream(chunks: AsyncIterator[bytes], output_path: Path) -> None:
+    """Enhance audio arriving as ``chunks`` (e.g. a download) into FLAC at ``output_path``.
+
+    Enhancement runs while the bytes arrive; the caller caches the result
+    once the source's content hash is known. ``output_path`` is removed
+    on failure.
+    """
+    try:
+        await pipe_ffmpeg(
+            _enhance_cmd("pipe:0", output_path), chunks, timeout=1800,
+            label="Audio enhancement",
+        )
+    except BaseException:
+        output_path.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import signal
+from typing import AsyncIterator, Callable
+
+# Keep only the tail of stderr for error messages; long encodes log a lot.
+STDERR_TAIL = 64 * 1024
+
+ProgressCallback = Callable[[float], None]
+
+
+async def start_process(cmd: list[str], stdin: bool = False) -> asyncio.subprocess.Process:
+    """Spawn ``cmd`` with piped output (and input if ``stdin``) in its own process group.
+
+    The group lets ``kill_process`` also take down helpers the command
+    spawns itself (e.g. the ffmpeg yt-dlp runs for post-processing).
+    """
+    return await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if stdin else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+
+
+async def kill_process(proc: asyncio.subprocess.Process):
+    """Kill ``proc`` and its process group if still running, and reap it."""
+    if proc.returncode is None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    await proc.wait()
+
+
+async def run_process(cmd: list[str], timeout: int) -> tuple[int, bytes, bytes]:
+    """Run ``cmd`` to completion; returns (returncode, stdout, stderr).
+
+    Raises asyncio.TimeoutError after ``timeout`` seconds. On timeout or
+    cancellation the process group is killed before the error propagates.
+    """
+    proc = await start_process(cmd)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except BaseException:
+        await kill_process(proc)
+        raise
+    return proc.returncode, stdout, stderr
+
+
+async def run_ffmpeg(
+    cmd: list[str],
+    timeout: int,
+    label: str,
+    duration: float = 0.0,
+    on_progress: ProgressCallback | None = None,
+) -> None:
+    """Run an FFmpeg command, raising RuntimeError on timeout or failure.
+
+    When ``duration`` and ``on_progress`` are given, FFmpeg is run with
+    ``-progress pipe:1`` and ``on_progress`` receives the fraction of
+    ``duration`` encoded so far (0.0-1.0) as ``out_time`` advances.
+    If the calling task is cancelled, FFmpeg is killed before the
+    cancellation propagates; callers remove their partial outputs.
+    """
+    if on_progress and duration > 0:
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    proc = await start_process(cmd)
+    stderr_tail = bytearray()
+
+    async def read_stderr():
+        while chunk := await proc.stderr.read(8192):
+            stderr_tail.extend(chunk)
+            del stderr_tail[:-STDERR_TAIL]
+
+    async def read_progress():
+        last = -1.0
+        while line := await proc.stdout.readline():
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            # out_time_us and (despite its name) out_time_ms are both microseconds
+            if key not in ("out_time_us", "out_time_ms") or not value.isdigit():
+                continue
+            fraction = min(1.0, int(value) / 1_000_000 / duration)
+            if on_progress and duration > 0 and fraction - last >= 0.005:
+                last = fraction
+                on_progress(fraction)
+
+    async def run():
+        await asyncio.gather(read_stderr(), read_progress())
+        return await proc.wait()
+
+    try:
+        returncode = await asyncio.wait_for(run(), timeout=timeout)
+    except asyncio.TimeoutError:
+        await kill_process(proc)
+        raise RuntimeError(f"{label} timed out after {timeout // 60} minutes")
+    except BaseException:
+        await kill_process(proc)
+        raise
+    if returncode != 0:
+        raise RuntimeError(f"{label} failed: {stderr_tail.decode(errors='replace')}")
+    if on_progress:
+        on_progress(1.0)
+
+
+async def pipe_ffmpeg(
+    cmd: list[str],
+    chunks: AsyncIterator[bytes],
+    timeout: int,
+    label: str,
+) -> None:
+    """Run an FFmpeg command reading ``pipe:0``, fed from ``chunks``.
+
+    Each write waits for the pipe to drain, so a slower FFmpeg throttles
+    the producer rather than buffering its output in memory. Errors from
+    ``chunks`` propagate after FFmpeg is killed; FFmpeg failures raise
+    RuntimeError as in ``run_ffmpeg``.
+    """
+    proc = await start_process(cmd, stdin=True)
+    stderr_tail = bytearray()
+
+    async def read_stderr():
+        while chunk := await proc.stderr.read(8192):
+            stderr_tail.extend(chunk)
+            del stderr_tail[:-STDERR_TAIL]
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # FFmpeg exited early; its return code says why
+        finally:
+            proc.stdin.close()
+
+    async def run():
+        await asyncio.gather(feed(), read_stderr(), proc.stdout.read())
+        return await proc.wait()
+
+    try:
+        returncode = await asyncio.wait_for(run(), timeout=timeout)
+    except asyncio.TimeoutError:
+        await kill_process(proc)
+        raise RuntimeError(f"{label} timed out after {timeout // 60} minutes")
+    except BaseException:
+        await kill_process(proc)
+        raise
+    if returncode != 0:
+        raise RuntimeError(f"{label} failed: {stderr_tail.decode(errors='replace')}")
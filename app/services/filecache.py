@@ -0,0 +1,203 @@
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from app.services.db import get_conn, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_files (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    meta TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_files_lru ON cache_files (namespace, last_used);
+CREATE TABLE IF NOT EXISTS cache_refs (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    PRIMARY KEY (namespace, key, owner)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_refs_owner ON cache_refs (namespace, owner);
+"""
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    path: Path
+    size: int
+    meta: dict
+
+
+class FileCache:
+    """Content library of files on disk, indexed in SQLite.
+
+    Each entry can be referenced by any number of owners (usually job ids).
+    Entries with no references are evicted least-recently-used first once the
+    namespace exceeds its byte budget; referenced entries are never evicted,
+    so in-flight jobs never lose a file.
+    """
+
+    def __init__(self, namespace: str, budget: Callable[[], int]):
+        self.namespace = namespace
+        self._budget = budget
+
+    @property
+    def conn(self):
+        return get_conn(SCHEMA)
+
+    def get(self, key: str, owner: str = "") -> CacheEntry | None:
+        """Look up ``key``; if ``owner`` is given, also take a reference to it."""
+        with transaction(self.conn) as conn:
+            row = conn.execute(
+                "SELECT * FROM cache_files WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if not Path(row["path"]).exists():
+                self._drop(conn, key)
+                return None
+            conn.execute(
+                "UPDATE cache_files SET last_used = ? WHERE namespace = ? AND key = ?",
+                (time.time(), self.namespace, key),
+            )
+            if owner:
+                self._ref(conn, key, owner)
+        return self._entry(row)
+
+    def put(self, key: str, path: Path, owner: str = "", meta: dict | None = None) -> CacheEntry:
+        """Register a file already written to ``path``, then evict down to budget."""
+        size = path.stat().st_size
+        with transaction(self.conn) as conn:
+            conn.execute(
+                "INSERT INTO cache_files (namespace, key, path, size, last_used, meta) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(namespace, key) DO UPDATE SET "
+                "path=excluded.path, size=excluded.size, last_used=excluded.last_used, "
+                "meta=excluded.meta",
+                (self.namespace, key, str(path), size, time.time(), json.dumps(meta or {})),
+            )
+            if owner:
+                self._ref(conn, key, owner)
+        self.evict()
+        return CacheEntry(key=key, path=path, size=size, meta=meta or {})
+
+    def update_meta(self, key: str, **meta):
+        """Merge ``meta`` into an entry's metadata."""
+        with transaction(self.conn) as conn:
+            row = conn.execute(
+                "SELECT meta FROM cache_files WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return
+            merged = {**json.loads(row["meta"]), **meta}
+            conn.execute(
+                "UPDATE cache_files SET meta = ? WHERE namespace = ? AND key = ?",
+                (json.dumps(merged), self.namespace, key),
+            )
+
+    def entries(self) -> list[CacheEntry]:
+        """All entries whose files still exist, most recently used first."""
+        rows = self.conn.execute(
+            "SELECT * FROM cache_files WHERE namespace = ? ORDER BY last_used DESC",
+            (self.namespace,),
+        ).fetchall()
+        return [self._entry(r) for r in rows if Path(r["path"]).exists()]
+
+    def acquire(self, key: str, owner: str):
+        """Reference ``key`` for ``owner``; works before the entry is put, pinning it from then on."""
+        if not owner:
+            return
+        with transaction(self.conn) as conn:
+            self._ref(conn, key, owner)
+
+    def acquire_path(self, path: Path, owner: str) -> bool:
+        """Reference the entry stored at ``path``, if any. Returns True if found."""
+        with transaction(self.conn) as conn:
+            row = conn.execute(
+                "SELECT key FROM cache_files WHERE namespace = ? AND path = ?",
+                (self.namespace, str(path)),
+            ).fetchone()
+            if row is None:
+                return False
+            self._ref(conn, row["key"], owner)
+        return True
+
+    def release(self, key: str, owner: str):
+        self.conn.execute(
+            "DELETE FROM cache_refs WHERE namespace = ? AND key = ? AND owner = ?",
+            (self.namespace, key, owner),
+        )
+
+    def release_owner(self, owner: str):
+        """Drop every reference held by ``owner`` (e.g. when a job finishes)."""
+        self.conn.execute(
+            "DELETE FROM cache_refs WHERE namespace = ? AND owner = ?",
+            (self.namespace, owner),
+        )
+
+    def discard(self, key: str) -> bool:
+        """Delete an entry and its file unless it is referenced. Returns True if deleted."""
+        with transaction(self.conn) as conn:
+            row = conn.execute(
+                "SELECT path FROM cache_files f WHERE namespace = ? AND key = ? AND NOT EXISTS "
+                "(SELECT 1 FROM cache_refs r WHERE r.namespace = f.namespace AND r.key = f.key)",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return False
+            self._drop(conn, key)
+        Path(row["path"]).unlink(missing_ok=True)
+        return True
+
+    def evict(self) -> int:
+        """Delete unreferenced entries, oldest first, until under budget. Returns bytes freed."""
+        budget = self._budget()
+        doomed: list[str] = []
+        freed = 0
+        with transaction(self.conn) as conn:
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache_files WHERE namespace = ?",
+                (self.namespace,),
+            ).fetchone()[0]
+            if total <= budget:
+                return 0
+            rows = conn.execute(
+                "SELECT key, path, size FROM cache_files f WHERE namespace = ? AND NOT EXISTS "
+                "(SELECT 1 FROM cache_refs r WHERE r.namespace = f.namespace AND r.key = f.key) "
+                "ORDER BY last_used",
+                (self.namespace,),
+            ).fetchall()
+            for row in rows:
+                if total - freed <= budget:
+                    break
+                self._drop(conn, row["key"])
+                doomed.append(row["path"])
+                freed += row["size"]
+        for path in doomed:
+            Path(path).unlink(missing_ok=True)
+        return freed
+
+    def _ref(self, conn, key: str, owner: str):
+        conn.execute(
+            "INSERT OR IGNORE INTO cache_refs (namespace, key, owner) VALUES (?, ?, ?)",
+            (self.namespace, key, owner),
+        )
+
+    def _drop(self, conn, key: str):
+        conn.execute(
+            "DELETE FROM cache_files WHERE namespace = ? AND key = ?", (self.namespace, key)
+        )
+
+    @staticmethod
+    def _entry(row) -> CacheEntry:
+        return CacheEntry(
+            key=row["key"], path=Path(row["path"]), size=row["size"], meta=json.loads(row["meta"])
+        )
@@ -0,0 +1,38 @@
+import httpx
+
+from app.config import settings
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:  # httpx[http2] not installed
+    HTTP2 = False
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Process-wide pooled HTTP client (HTTP/2 + keep-alive when available).
+
+    Pass a per-request ``timeout=`` for calls that need a different budget.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2,
+            follow_redirects=True,
+            timeout=httpx.Timeout(120, connect=15),
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_connections,
+                keepalive_expiry=60,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,336 @@
+import asyncio
+import heapq
+import itertools
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timedelta
+from typing import Callable
+
+from app.services.db import get_conn, transaction
+
+
+@dataclass
+class JobStatus:
+    id: str
+    status: str = "pending"
+    step: str = ""
+    progress: int = 0
+    error: str = ""
+    output_path: str = ""
+    thumbnail_path: str = ""
+    telegram_result: str = ""
+    youtube_result: str = ""
+    priority: int = 0
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    updated_at: str = ""
+    # Per-stage status and timings: {name: {status, started_at, finished_at, error}}
+    stages: dict[str, dict] = field(default_factory=dict)
+    # run_pipeline keyword arguments, so the job can be resumed or retried
+    params: dict = field(default_factory=dict)
+    # Manifest of finished stage results: {stage: {"path": ...} | {"paths": [...]} | {"value": ...}}
+    artifacts: dict[str, dict] = field(default_factory=dict)
+    # Worker process running the job (see WORKER_ID)
+    worker: str = ""
+    batch_id: str = ""
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "JobStatus":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+# Statuses in which a job holds a worker; "rendered" jobs wait on the publish queue
+ACTIVE_STATUSES = ("queued", "running")
+
+# Identifies this worker process in the jobs it runs and in the heartbeat table
+WORKER_ID = uuid.uuid4().hex[:12]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at DESC, id DESC);
+-- Normalized source URL of each job, for batch dedupe
+CREATE TABLE IF NOT EXISTS job_sources (
+    job_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_sources_url ON job_sources (url);
+CREATE TABLE IF NOT EXISTS job_cancel_requests (
+    id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL
+);
+"""
+
+
+class JobStore:
+    """SQLite-backed job store, indexed on created_at and status.
+
+    Indexed columns are kept alongside the full JobStatus serialized as JSON,
+    so new JobStatus fields need no schema migration.
+    """
+
+    def __init__(self):
+        self._watchers: dict[str, set[asyncio.Event]] = {}
+
+    @property
+    def conn(self):
+        return get_conn(SCHEMA)
+
+    def save(self, job: JobStatus):
+        job.updated_at = datetime.now().isoformat()
+        self.conn.execute(
+            "INSERT INTO jobs (id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET status=excluded.status, "
+            "updated_at=excluded.updated_at, data=excluded.data",
+            (job.id, job.status, job.created_at, job.updated_at, json.dumps(asdict(job))),
+        )
+        for event in self._watchers.get(job.id, ()):
+            event.set()
+
+    def update(self, job_id: str, apply: Callable[[JobStatus], None]) -> JobStatus | None:
+        """Re-read ``job_id``, apply ``apply`` to it and save, in one transaction.
+
+        For writers that don't own the job's in-memory copy (the publish
+        queue), so they never overwrite newer fields with a stale snapshot.
+        """
+        with transaction(self.conn):
+            job = self.get(job_id)
+            if job is None:
+                return None
+            apply(job)
+            self.save(job)
+        return job
+
+    @contextmanager
+    def watch(self, job_id: str):
+        """Yield an asyncio.Event that is set whenever this process saves ``job_id``.
+
+        Saves from other workers are not signalled; watchers should also
+        re-read the job periodically.
+        """
+        event = asyncio.Event()
+        self._watchers.setdefault(job_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            watchers = self._watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(event)
+                if not watchers:
+                    del self._watchers[job_id]
+
+    def get(self, job_id: str) -> JobStatus | None:
+        row = self.conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return JobStatus.from_dict(json.loads(row["data"]))
+
+    def get_many(self, job_ids: list[str]) -> dict[str, JobStatus]:
+        found: dict[str, JobStatus] = {}
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT data FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for row in rows:
+                job = JobStatus.from_dict(json.loads(row["data"]))
+                found[job.id] = job
+        return found
+
+    def add_source(self, job_id: str, url: str):
+        """Record ``job_id``'s normalized source URL (see ``find_sources``)."""
+        self.conn.execute(
+            "INSERT INTO job_sources (job_id, url) VALUES (?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET url=excluded.url",
+            (job_id, url),
+        )
+
+    def index_sources(self, normalize: Callable[[str], str]):
+        """Record the source URL of jobs saved before ``job_sources`` existed."""
+        rows = self.conn.execute(
+            "SELECT id, COALESCE(json_extract(data, '$.params.audio_url'), '') AS url FROM jobs "
+            "WHERE id NOT IN (SELECT job_id FROM job_sources)"
+        ).fetchall()
+        with transaction(self.conn) as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO job_sources (job_id, url) VALUES (?, ?)",
+                [(r["id"], normalize(r["url"]) if r["url"] else "") for r in rows],
+            )
+
+    def find_sources(self, urls: list[str]) -> dict[str, str]:
+        """Map each of the normalized ``urls`` already used by a job not failed or cancelled to its id."""
+        found: dict[str, str] = {}
+        urls = list(dict.fromkeys(urls))
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            rows = self.conn.execute(
+                "SELECT s.url, s.job_id FROM job_sources s JOIN jobs j ON j.id = s.job_id "
+                f"WHERE s.url IN ({','.join('?' * len(chunk))}) "
+                "AND j.status NOT IN ('failed', 'cancelled') ORDER BY j.created_at",
+                chunk,
+            ).fetchall()
+            # Latest job wins, as with one entry per URL
+            found.update((r["url"], r["job_id"]) for r in rows)
+        return found
+
+    def save_batch(self, batch_id: str, data: dict):
+        self.conn.execute(
+            "INSERT INTO batches (id, created_at, data) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data=excluded.data",
+            (batch_id, datetime.now().isoformat(), json.dumps(data)),
+        )
+
+    def get_batch(self, batch_id: str) -> dict | None:
+        row = self.conn.execute("SELECT data FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def heartbeat(self):
+        """Record that this worker process is alive."""
+        self.conn.execute(
+            "INSERT INTO workers (id, last_seen) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET last_seen=excluded.last_seen",
+            (WORKER_ID, time.time()),
+        )
+
+    def take_lease(self, name: str) -> bool:
+        """Hold the ``name`` lease for this worker, unless a live worker holds it.
+
+        Leases of workers that stopped heartbeating are taken over.
+        """
+        with transaction(self.conn) as conn:
+            conn.execute(
+                "DELETE FROM leases WHERE name = ? AND holder NOT IN (SELECT id FROM workers)",
+                (name,),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO leases (name, holder) VALUES (?, ?)", (name, WORKER_ID)
+            )
+            row = conn.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return row["holder"] == WORKER_ID
+
+    def release_lease(self, name: str):
+        self.conn.execute(
+            "DELETE FROM leases WHERE name = ? AND holder = ?", (name, WORKER_ID)
+        )
+
+    def claim_orphans(self, stale_after: float) -> list[JobStatus]:
+        """Take over queued or running jobs whose worker has not been seen for ``stale_after`` seconds.
+
+        Claimed jobs are reassigned to this worker; the caller resubmits them.
+        """
+        cutoff = time.time() - stale_after
+        marks = ",".join("?" * len(ACTIVE_STATUSES))
+        with transaction(self.conn) as conn:
+            conn.execute("DELETE FROM workers WHERE last_seen < ?", (cutoff,))
+            rows = conn.execute(
+                f"SELECT data FROM jobs WHERE status IN ({marks}) "
+                "AND COALESCE(json_extract(data, '$.worker'), '') NOT IN "
+                "(SELECT id FROM workers) ORDER BY created_at",
+                ACTIVE_STATUSES,
+            ).fetchall()
+            jobs = [JobStatus.from_dict(json.loads(r["data"])) for r in rows]
+            for job in jobs:
+                job.worker = WORKER_ID
+                conn.execute(
+                    "UPDATE jobs SET data = ? WHERE id = ?", (json.dumps(asdict(job)), job.id)
+                )
+        return jobs
+
+    def _scan(self, where: list[str], params: list, limit: int, status: str | None) -> list:
+        if status is not None:
+            where, params = ["status = ?", *where], [status, *params]
+        sql = "SELECT created_at, id, data FROM jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        return self.conn.execute(sql, [*params, limit]).fetchall()
+
+    def list(
+        self,
+        limit: int = 20,
+        cursor: str = "",
+        statuses: list[str] | None = None,
+    ) -> tuple[list[JobStatus], str]:
+        """Return one page of jobs, newest first, and the cursor for the next page.
+
+        The cursor is ``"<created_at>|<id>"`` of the last row returned, so each
+        page is a bounded index range scan regardless of table size. With
+        several ``statuses`` each one gets its own scan of the status index
+        and the (already sorted) results are merged, rather than one IN
+        query that SQLite would sort in a temporary B-tree.
+        """
+        where, params = [], []
+        if cursor:
+            created_at, _, job_id = cursor.partition("|")
+            where.append("(created_at, id) < (?, ?)")
+            params.extend([created_at, job_id])
+        scans = [
+            self._scan(where, params, limit, status)
+            for status in dict.fromkeys(statuses or [None])
+        ]
+        rows = heapq.merge(*scans, key=lambda r: (r["created_at"], r["id"]), reverse=True)
+
+        page = [JobStatus.from_dict(json.loads(r["data"])) for r in itertools.islice(rows, limit)]
+        next_cursor = f"{page[-1].created_at}|{page[-1].id}" if len(page) == limit else ""
+        return page, next_cursor
+
+    def request_cancel(self, job_id: str):
+        """Ask whichever worker process owns ``job_id`` to cancel it."""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO job_cancel_requests (id) VALUES (?)", (job_id,)
+        )
+
+    def take_cancel_requests(self, job_ids) -> set[str]:
+        """Pop the pending cancel requests among ``job_ids``."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        marks = ",".join("?" * len(job_ids))
+        rows = self.conn.execute(
+            f"DELETE FROM job_cancel_requests WHERE id IN ({marks}) RETURNING id", job_ids
+        ).fetchall()
+        return {r["id"] for r in rows}
+
+    def retire(self, older_than: timedelta) -> int:
+        """Delete finished jobs created before ``now - older_than``. Returns rows removed."""
+        cutoff = (datetime.now() - older_than).isoformat()
+        cur = self.conn.execute(
+            f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) "
+            "AND created_at < ?",
+            (*FINISHED_STATUSES, cutoff),
+        )
+        self.conn.execute("DELETE FROM batches WHERE created_at < ?", (cutoff,))
+        self.conn.execute("DELETE FROM job_sources WHERE job_id NOT IN (SELECT id FROM jobs)")
+        # Requests for jobs that have since finished elsewhere
+        self.conn.execute(
+            "DELETE FROM job_cancel_requests WHERE id NOT IN "
+            f"(SELECT id FROM jobs WHERE status NOT IN ({','.join('?' * len(FINISHED_STATUSES))}))",
+            FINISHED_STATUSES,
+        )
+        return cur.rowcount
+
+
+job_store = JobStore()
@@ -0,0 +1,82 @@
+import math
+import uuid
+from pathlib import Path
+
+from app.config import settings
+from app.services.coalesce import Coalescer
+from app.services.encoding import MEZZ_ENCODE_ARGS, MEZZ_FPS, MEZZ_GOP, MEZZ_HEIGHT, SCALE_PAD_FILTER
+from app.services.ffmpeg import run_ffmpeg
+from app.services.filecache import FileCache
+from app.services.probe import probe, probe_many
+
+# Clips are trimmed to a whole number of GOPs, so every GOP boundary on a
+# joined timeline is a keyframe.
+# v2: clips are always transcoded (earlier entries may be unverified remuxes)
+MEZZ_TAG = f"h264_{MEZZ_HEIGHT}p{MEZZ_FPS}_g{MEZZ_GOP}_v2"
+
+mezzanine_cache = FileCache("mezzanine", lambda: settings.mezzanine_cache_bytes)
+
+# Encodes in progress by cache key; concurrent jobs normalizing the same clip
+# in this process share one encode
+_encodes = Coalescer()
+
+
+def is_mezzanine(path: Path) -> bool:
+    return path.parent == settings.mezzanine_dir
+
+
+async def normalize_clip(src: Path, owner: str = "") -> Path:
+    """Return the mezzanine version of ``src``, transcoding it on first use."""
+    key = f"{src.stem}@{MEZZ_TAG}"
+    entry = mezzanine_cache.get(key, owner=owner)
+    if entry:
+        return entry.path
+
+    # Referenced before the shared encode registers it, so it can't be
+    # evicted in between; a cancelled job's release drops the reference
+    mezzanine_cache.acquire(key, owner)
+    return await _encodes.run(key, lambda: _transcode(src, key))
+
+
+async def _transcode(src: Path, key: str) -> Path:
+    info = await probe(src)
+    out_path = settings.mezzanine_dir / f"{key}.mp4"
+    # Unique per attempt, so encodes in other worker processes never share it
+    part_path = out_path.with_suffix(f".{uuid.uuid4().hex[:8]}.part.mp4")
+
+    # Always transcode: a clip that merely looks like a mezzanine (h264 1080p30)
+    # can still differ in GOP, profile or SPS/PPS, which breaks stream-copy joins
+    frames = math.floor(info.duration * MEZZ_FPS / MEZZ_GOP) * MEZZ_GOP
+    if frames <= 0:
+        raise RuntimeError(f"Clip too short to normalize: {src.name}")
+    cmd = [
+        "ffmpeg", "-y", "-nostdin",
+        "-i", str(src),
+        "-vf", f"{SCALE_PAD_FILTER},fps={MEZZ_FPS}",
+        *MEZZ_ENCODE_ARGS,
+        "-an",
+        "-frames:v", str(frames),
+        "-movflags", "+faststart",
+        str(part_path),
+    ]
+    try:
+        await run_ffmpeg(cmd, timeout=900, label=f"Normalizing {src.name}")
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+    # Another worker process may have finished the same clip meanwhile
+    entry = mezzanine_cache.get(key)
+    if entry:
+        part_path.unlink(missing_ok=True)
+        return entry.path
+    part_path.replace(out_path)
+    mezzanine_cache.put(key, out_path, meta={"source": src.name, "frames": frames})
+    return out_path
+
+
+async def normalize_clips(clips: list[Path], owner: str = "") -> list[Path]:
+    """Normalize each clip into the mezzanine format (cached across jobs)."""
+    settings.ensure_dirs()
+    await probe_many(clips)  # warm the probe cache in parallel
+    return [await normalize_clip(clip, owner=owner) for clip in clips]
@@ -1,10 +1,16 @@
 import asyncio
 import httpx
+import json
 import random
+import time
 import uuid
 from pathlib import Path
 
 from app.config import settings
+from app.services.coalesce import Coalescer
+from app.services.db import get_conn, transaction
+from app.services.filecache import FileCache
+from app.services.http import get_client
 
 SEARCH_QUERIES = [
     "Shwedagon pagoda Myanmar",
@@ -20,71 +26,281 @@ SEARCH_QUERIES = [
 ]
 
 PEXELS_VIDEO_API = "https://api.pexels.com/videos/search"
+SEARCH_PARAMS = {"per_page": 5, "size": "large", "orientation": "landscape"}
 
+DOWNLOAD_CHUNK = 1024 * 1024
+DOWNLOAD_RETRIES = 3
+MAX_RATE_LIMIT_WAIT = 60
 
-async def search_and_download_stock(count: int = 5) -> list[Path]:
-    """Search Pexels for Myanmar Buddhist videography and download clips."""
-    settings.ensure_dirs()
-    batch_id = uuid.uuid4().hex[:8]
-    api_key = settings.pexels_api_key
-    if not api_key:
-        raise ValueError("PEXELS_API_KEY not configured")
 
-    downloaded: list[Path] = []
-    queries = random.sample(SEARCH_QUERIES, min(count, len(SEARCH_QUERIES)))
+# Persistent library of downloaded clips, keyed by Pexels video id + rendition id
+clip_library = FileCache("pexels_clips", lambda: settings.stock_cache_bytes)
 
-    async with httpx.AsyncClient(timeout=120) as client:
-        for i, query in enumerate(queries):
-            if len(downloaded) >= count:
-                break
+# Clip downloads in progress by library key; concurrent jobs picking the same
+# clip share one download instead of writing the same .part file
+_downloads = Coalescer()
+
+
+def _choose_rendition(video: dict) -> dict | None:
+    """Pick the HD/Full HD file closest to 1080p."""
+    video_files = video.get("video_files", [])
+    hd_files = [
+        f for f in video_files
+        if f.get("height", 0) >= 720 and f.get("quality") in ("hd", "sd")
+    ]
+    if not hd_files:
+        hd_files = video_files
+    if not hd_files:
+        return None
+    return sorted(hd_files, key=lambda f: abs(f.get("height", 0) - 1080))[0]
+
+
+def _library_fallback(count: int, owner: str) -> list[Path]:
+    """Pick up to ``count`` clips from the local library without touching the network."""
+    entries = clip_library.entries()
+    picked = random.sample(entries, min(count, len(entries)))
+    return [e.path for e in picked if clip_library.get(e.key, owner=owner)]
+
+
+class SearchCache:
+    """Persistent Pexels search results keyed by (query, per_page, size, orientation).
+
+    Each key holds a shuffled pool of videos gathered from up to
+    ``PEXELS_CACHE_PAGES`` result pages. Picks rotate through the pool, so
+    successive jobs see different clips without new API calls; once the TTL
+    expires the next page is fetched and merged in.
+    """
 
-            resp = await client.get(
-                PEXELS_VIDEO_API,
-                headers={"Authorization": api_key},
-                params={
-                    "query": query,
-                    "per_page": 5,
-                    "size": "large",
-                    "orientation": "landscape",
-                },
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pexels_search (
+        key TEXT PRIMARY KEY,
+        videos TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        fetched_at REAL NOT NULL,
+        rotation INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    @property
+    def conn(self):
+        return get_conn(self.SCHEMA)
+
+    @staticmethod
+    def key(query: str, params: dict) -> str:
+        return json.dumps([query, params["per_page"], params["size"], params["orientation"]])
+
+    def lookup(self, key: str) -> tuple[list[dict], int, bool]:
+        """Return (videos, last page fetched, fresh?) for ``key``."""
+        row = self.conn.execute(
+            "SELECT videos, page, fetched_at FROM pexels_search WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return [], 0, False
+        fresh = time.time() - row["fetched_at"] < settings.pexels_search_ttl_hours * 3600
+        return json.loads(row["videos"]), row["page"], fresh
+
+    def store(self, key: str, page: int, videos: list[dict]):
+        """Merge a freshly fetched result page into the pool."""
+        slim = [{"id": v["id"], "video_files": v.get("video_files", [])} for v in videos]
+        with transaction(self.conn) as conn:
+            row = conn.execute("SELECT videos FROM pexels_search WHERE key = ?", (key,)).fetchone()
+            old = json.loads(row["videos"]) if row else []
+            seen = {v["id"] for v in slim}
+            pool = slim + [v for v in old if v["id"] not in seen]
+            pool = pool[: SEARCH_PARAMS["per_page"] * settings.pexels_cache_pages]
+            random.shuffle(pool)
+            conn.execute(
+                "INSERT INTO pexels_search (key, videos, page, fetched_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET videos=excluded.videos, page=excluded.page, "
+                "fetched_at=excluded.fetched_at",
+                (key, json.dumps(pool), page, time.time()),
             )
-            resp.raise_for_status()
-            data = resp.json()
 
-            videos = data.get("videos", [])
+    def next_video(self, key: str) -> dict | None:
+        """Take the next video in the key's rotation."""
+        with transaction(self.conn) as conn:
+            row = conn.execute(
+                "SELECT videos, rotation FROM pexels_search WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            videos = json.loads(row["videos"])
             if not videos:
-                continue
+                return None
+            conn.execute(
+                "UPDATE pexels_search SET rotation = rotation + 1 WHERE key = ?", (key,)
+            )
+        return videos[row["rotation"] % len(videos)]
+
+
+search_cache = SearchCache()
+
+
+class _RateLimiter:
+    """Paces Pexels API calls from the X-Ratelimit-* headers instead of fixed sleeps."""
+
+    def __init__(self):
+        self.remaining: int | None = None
+        self.reset_at: float = 0.0
 
-            video = random.choice(videos)
-            # Pick HD or Full HD file
-            video_files = video.get("video_files", [])
-            hd_files = [
-                f for f in video_files
-                if f.get("height", 0) >= 720 and f.get("quality") in ("hd", "sd")
-            ]
-            if not hd_files:
-                hd_files = video_files
-
-            if not hd_files:
+    def update(self, headers: httpx.Headers):
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        if remaining is not None and remaining.isdigit():
+            self.remaining = int(remaining)
+        if reset is not None and reset.isdigit():
+            self.reset_at = float(reset)
+
+    async def wait(self):
+        if self.remaining is None or self.remaining > settings.pexels_min_remaining:
+            return
+        delay = self.reset_at - time.time()
+        if delay > 0:
+            await asyncio.sleep(min(delay, MAX_RATE_LIMIT_WAIT))
+
+
+_rate_limiter = _RateLimiter()
+
+
+async def _search(query: str, sem: asyncio.Semaphore) -> str | None:
+    """Make sure ``query`` has cached results; returns its cache key, or None.
+
+    Only hits the API when the cached pool is missing or past its TTL. A
+    failed refresh falls back to stale results.
+    """
+    key = SearchCache.key(query, SEARCH_PARAMS)
+    cached, page, fresh = search_cache.lookup(key)
+    if fresh:
+        return key
+
+    next_page = page % settings.pexels_cache_pages + 1
+    videos = await _search_api(query, next_page, sem)
+    if videos:
+        search_cache.store(key, next_page, videos)
+        return key
+    return key if cached else None
+
+
+async def _search_api(query: str, page: int, sem: asyncio.Semaphore) -> list[dict]:
+    """Run one Pexels video search; returns [] on failure."""
+    client = get_client()
+    async with sem:
+        for _ in range(2):
+            await _rate_limiter.wait()
+            try:
+                resp = await client.get(
+                    PEXELS_VIDEO_API,
+                    headers={"Authorization": settings.pexels_api_key},
+                    params={"query": query, "page": page, **SEARCH_PARAMS},
+                    timeout=30,
+                )
+            except httpx.HTTPError:
+                return []
+            _rate_limiter.update(resp.headers)
+            if resp.status_code == 429:
+                _rate_limiter.remaining = 0
                 continue
+            if resp.is_error:
+                return []
+            return resp.json().get("videos", [])
+    return []
+
+
+async def _download(url: str, out_path: Path, sem: asyncio.Semaphore):
+    """Download ``url`` to ``out_path``, resuming a partial ``.part`` file via Range."""
+    client = get_client()
+    part_path = out_path.with_suffix(".part")
+    async with sem:
+        for attempt in range(DOWNLOAD_RETRIES):
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                async with client.stream("GET", url, headers=headers, timeout=300) as resp:
+                    if resp.status_code == 416:
+                        break  # already complete
+                    resp.raise_for_status()
+                    mode = "ab" if offset and resp.status_code == 206 else "wb"
+                    with open(part_path, mode, buffering=DOWNLOAD_CHUNK) as f:
+                        async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK):
+                            f.write(chunk)
+                break
+            except httpx.HTTPError:
+                if attempt == DOWNLOAD_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+    part_path.replace(out_path)
+
+
+async def _fetch_clip(
+    key: str, link: str, query: str, owner: str, sem: asyncio.Semaphore
+) -> Path:
+    entry = clip_library.get(key, owner=owner)
+    if entry:
+        return entry.path
+
+    async def download() -> Path:
+        out_path = settings.stock_dir / f"pexels_{key}.mp4"
+        await _download(link, out_path, sem)
+        clip_library.put(key, out_path, meta={"query": query})
+        return out_path
+
+    # Referenced before the shared download registers it, so it can't be
+    # evicted in between; a cancelled job's release drops the reference
+    clip_library.acquire(key, owner)
+    return await _downloads.run(key, download)
+
 
-            # Prefer 1080p
-            chosen = sorted(hd_files, key=lambda f: abs(f.get("height", 0) - 1080))[0]
-            video_url = chosen["link"]
+async def search_and_download_stock(count: int = 5, owner: str = "") -> list[Path]:
+    """Search Pexels for Myanmar Buddhist videography and return local clip paths.
+
+    Clips come from the persistent library under ``settings.stock_dir`` when
+    already present and are only downloaded on a miss. Search results come
+    from ``search_cache`` while fresh. Searches and downloads run
+    concurrently (bounded by ``PEXELS_CONCURRENCY``) on the shared HTTP
+    client. Every returned clip is referenced by ``owner``; call
+    ``clip_library.release_owner(owner)`` when done with them.
+    """
+    settings.ensure_dirs()
+    owner = owner or uuid.uuid4().hex[:8]
+    if not settings.pexels_api_key:
+        fallback = _library_fallback(count, owner)
+        if fallback:
+            return fallback
+        raise ValueError("PEXELS_API_KEY not configured")
+
+    queries = random.sample(SEARCH_QUERIES, min(count, len(SEARCH_QUERIES)))
+    sem = asyncio.Semaphore(settings.pexels_concurrency)
+    keys = await asyncio.gather(*(_search(q, sem) for q in queries))
 
-            out_path = settings.stock_dir / f"stock_{batch_id}_{i:02d}.mp4"
-            async with client.stream("GET", video_url) as vresp:
-                vresp.raise_for_status()
-                with open(out_path, "wb") as f:
-                    async for chunk in vresp.aiter_bytes(8192):
-                        f.write(chunk)
+    picks: dict[str, tuple[str, str]] = {}
+    for query, search_key in zip(queries, keys):
+        if not search_key or len(picks) >= count:
+            continue
+        video = search_cache.next_video(search_key)
+        if not video:
+            continue
+        chosen = _choose_rendition(video)
+        if not chosen:
+            continue
+        key = f"{video['id']}_{chosen.get('id', chosen.get('height', 0))}"
+        picks.setdefault(key, (chosen["link"], query))
 
-            downloaded.append(out_path)
+    fetched = await asyncio.gather(
+        *(_fetch_clip(key, link, query, owner, sem) for key, (link, query) in picks.items()),
+        return_exceptions=True,
+    )
+    downloaded = [p for p in fetched if isinstance(p, Path)]
 
-            # Small delay to respect rate limits
-            await asyncio.sleep(0.5)
+    if len(downloaded) < count:
+        # Top up from the library when searches failed or came back empty
+        have = set(downloaded)
+        downloaded += [
+            p for p in _library_fallback(count, owner) if p not in have
+        ][: count - len(downloaded)]
 
     if not downloaded:
-        raise RuntimeError("No stock videos found from Pexels")
+        errors = [str(e) for e in fetched if isinstance(e, BaseException)]
+        detail = f": {errors[0]}" if errors else ""
+        raise RuntimeError(f"No stock videos found from Pexels{detail}")
 
     return downloaded
@@ -1,32 +1,241 @@
 import asyncio
-from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+from dataclasses import dataclass
 from pathlib import Path
 from datetime import datetime
 
 from app.config import settings
-from app.services.downloader import download_audio
-from app.services.enhancer import enhance_audio
-from app.services.pexels import search_and_download_stock
+from app.services.downloader import can_stream, download_audio, download_enhanced, source_audio
+from app.services.enhancer import ENHANCE_FILTERS, enhance_audio, enhanced_audio
+from app.services.pexels import clip_library, search_and_download_stock
 from app.services.compiler import compile_video
-from app.services.thumbnail import generate_thumbnail
-from app.services.telegram_pub import publish_to_telegram
+from app.services.mezzanine import MEZZ_FPS, MEZZ_GOP, mezzanine_cache, normalize_clips
+from app.services.probe import probe
+from app.services.reels import is_reel, pick_reel, reel_library
+from app.services.thumbnail import build_thumbnail, thumbnail_variant
+from app.services.publisher import DESTINATIONS, publish_queue
+from app.services.scheduler import scheduler
+from app.services.jobstore import JobStatus, job_store
+
+
+# Libraries a stage artifact may live in; a resumed job re-references them
+SHARED_CACHES = (source_audio, enhanced_audio, clip_library, mezzanine_cache, reel_library)
 
 
 @dataclass
-class JobStatus:
-    id: str
-    status: str = "pending"
-    step: str = ""
-    progress: int = 0
-    error: str = ""
-    output_path: str = ""
-    thumbnail_path: str = ""
-    telegram_result: str = ""
-    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+class Stage:
+    """A pipeline stage: runs once all ``deps`` have finished.
+
+    A failing optional stage is recorded but never cancels the rest of the
+    graph; a failing required stage cancels everything still running.
+    """
+    name: str
+    run: Callable[["StageResults"], Awaitable[Any]]
+    deps: tuple[str, ...] = ()
+    optional: bool = False
+    weight: int = 10
+    # Scheduler resource class ("network" / "cpu" / "stream"); None runs without a slot
+    resource: str | None = None
+
+
+class StageResults(dict):
+    """Stage name -> result of finished stages, as passed to ``Stage.run``.
+
+    ``wait`` lets a stage wait on a stage it doesn't list in ``deps``, only
+    on the code path that needs it.
+    """
+
+    def __init__(self, tasks: dict[str, asyncio.Task]):
+        super().__init__()
+        self._tasks = tasks
+
+    async def wait(self, name: str) -> Any:
+        # Shielded: a cancelled waiter must not cancel the other stage
+        return await asyncio.shield(self._tasks[name])
+
+
+class StageSkipped(Exception):
+    """Raised for a stage whose required dependency failed."""
+
+
+def _update_progress(job: JobStatus):
+    """Overall progress: stage weights scaled by each stage's own progress."""
+    total = sum(info.get("weight", 0) for info in job.stages.values()) or 1
+    done = sum(info.get("weight", 0) * info.get("progress", 0) / 100 for info in job.stages.values())
+    job.progress = max(job.progress, min(99, int(done * 100 / total)))
+
+
+def stage_progress(job: JobStatus, name: str) -> Callable[[float], None]:
+    """Progress callback for a long-running stage (fraction 0.0-1.0)."""
+
+    def report(fraction: float):
+        info = job.stages[name]
+        pct = int(fraction * 100)
+        if pct <= info.get("progress", 0):
+            return
+        info["progress"] = pct
+        _update_progress(job)
+        job_store.save(job)
+
+    return report
+
+
+def _dump_artifact(result: Any) -> dict | None:
+    """Manifest entry for a stage result, or None if it can't be checkpointed."""
+    if isinstance(result, Path):
+        return {"path": str(result)}
+    if isinstance(result, list) and result and all(isinstance(p, Path) for p in result):
+        return {"paths": [str(p) for p in result]}
+    if isinstance(result, (str, int, float, bool)):
+        return {"value": result}
+    return None
+
+
+def _restore_artifact(job: JobStatus, name: str) -> tuple[bool, Any]:
+    """Return (True, result) if stage ``name`` finished before and its files still exist.
+
+    Files that live in a shared cache are referenced by the job again first,
+    so they can't be evicted while it runs.
+    """
+    artifact = job.artifacts.get(name)
+    if artifact is None:
+        return False, None
+    if "value" in artifact:
+        return True, artifact["value"]
+    paths = [Path(p) for p in artifact.get("paths", [artifact.get("path", "")])]
+    for path in paths:
+        for cache in SHARED_CACHES:
+            if cache.acquire_path(path, job.id):
+                break
+    if not all(p.is_file() for p in paths):
+        del job.artifacts[name]
+        return False, None
+    return True, paths if "paths" in artifact else paths[0]
+
+
+async def run_stages(job: JobStatus, stages: list[Stage]) -> dict[str, Any]:
+    """Run a dependency graph of stages, overlapping independent ones.
+
+    Returns a mapping of stage name to result. Optional stages that failed
+    map to ``None``. Each finished stage's result is checkpointed in
+    ``job.artifacts``; a stage whose artifact is still there (a resumed or
+    retried job) is marked done without running, and stages that only feed
+    such stages are skipped.
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        unknown = [d for d in s.deps if d not in by_name]
+        if unknown:
+            raise ValueError(f"Stage {s.name} depends on unknown stage(s): {unknown}")
+
+    tasks: dict[str, asyncio.Task] = {}
+    results = StageResults(tasks)
+    failed: list[str] = []
+
+    for s in stages:
+        job.stages[s.name] = {
+            "status": "pending", "started_at": "", "finished_at": "", "error": "",
+            "progress": 0, "weight": s.weight,
+        }
+
+    # Checkpointed stages are restored; stages only feeding restored ones needn't run
+    restored: dict[str, Any] = {}
+    for s in stages:
+        ok, result = _restore_artifact(job, s.name)
+        if ok:
+            restored[s.name] = result
+    unneeded: set[str] = set()
+    for s in reversed(stages):
+        dependents = [d.name for d in stages if s.name in d.deps]
+        if s.name not in restored and dependents and all(
+            d in restored or d in unneeded for d in dependents
+        ):
+            unneeded.add(s.name)
+
+    async def _start(stage: Stage, info: dict):
+        info["status"] = "running"
+        info["started_at"] = datetime.now().isoformat()
+        job.step = stage.name
+        job_store.save(job)
+        return await stage.run(results)
 
+    async def _run(stage: Stage):
+        info = job.stages[stage.name]
+        if stage.name in restored or stage.name in unneeded:
+            result = restored.get(stage.name)
+            info["status"] = "done" if stage.name in restored else "skipped"
+            info["resumed"] = True
+            results[stage.name] = result
+            info["progress"] = 100
+            _update_progress(job)
+            job_store.save(job)
+            return result
 
-# In-memory job store
-jobs: dict[str, JobStatus] = {}
+        for dep in stage.deps:
+            try:
+                await tasks[dep]
+            except Exception:
+                if not by_name[dep].optional:
+                    job.stages[stage.name]["status"] = "skipped"
+                    raise StageSkipped(dep)
+
+        try:
+            if stage.resource:
+                info["status"] = "waiting"
+                async with scheduler.slot(stage.resource, job.id):
+                    result = await _start(stage, info)
+            else:
+                result = await _start(stage, info)
+        except Exception as e:
+            info["status"] = "failed"
+            info["error"] = str(e)
+            info["finished_at"] = datetime.now().isoformat()
+            if not stage.optional:
+                failed.append(stage.name)
+                raise
+            result = None
+        else:
+            info["status"] = "done"
+            info["finished_at"] = datetime.now().isoformat()
+            artifact = _dump_artifact(result)
+            if artifact:
+                job.artifacts[stage.name] = artifact
+
+        results[stage.name] = result
+        info["progress"] = 100
+        _update_progress(job)
+        job_store.save(job)
+        return result
+
+    # Create every task up front so dependents can await their deps' tasks.
+    for s in stages:
+        tasks[s.name] = asyncio.ensure_future(_run(s))
+
+    try:
+        pending = set(tasks.values())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+            for t in done:
+                exc = t.exception()
+                if exc and not isinstance(exc, StageSkipped):
+                    job.step = failed[0] if failed else job.step
+                    raise exc
+    finally:
+        for t in tasks.values():
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for info in job.stages.values():
+            if info["status"] in ("pending", "waiting", "running"):
+                info["status"] = "cancelled"
+
+    return results
+
+
+def _release_cached_files(job_id: str):
+    """Drop a job's references to shared library files so they can be evicted."""
+    for cache in SHARED_CACHES:
+        cache.release_owner(job_id)
 
 
 async def run_pipeline(
@@ -38,66 +247,198 @@ async def run_pipeline(
     stock_clip_count: int = 5,
     generate_thumb: bool = True,
     thumbnail_prompt: str = "",
+    publish_youtube: bool = False,
 ):
-    """Run the full Dhamma audio-to-video pipeline."""
-    job = jobs[job_id]
+    """Run the full Dhamma audio-to-video pipeline.
 
-    try:
-        # Step 1: Download audio
-        job.step = "downloading"
-        job.status = "running"
-        job.progress = 10
-        raw_audio = await download_audio(audio_url)
-
-        # Step 2: Enhance audio
-        job.step = "enhancing"
-        job.progress = 25
-        enhanced_audio = await enhance_audio(raw_audio)
-
-        # Step 3: Search & download stock videos
-        job.step = "fetching_stock"
-        job.progress = 40
-        stock_videos = await search_and_download_stock(count=stock_clip_count)
-
-        # Step 4: Generate thumbnail
-        thumbnail_path = None
-        if generate_thumb and settings.fal_key:
-            job.step = "generating_thumbnail"
-            job.progress = 50
-            try:
-                thumbnail_path = await generate_thumbnail(title, thumbnail_prompt)
-                job.thumbnail_path = str(thumbnail_path)
-            except Exception as e:
-                job.thumbnail_path = f"Error: {e}"
-
-        # Step 5: Compile video
-        job.step = "compiling"
-        job.progress = 65
-        output_video = await compile_video(enhanced_audio, stock_videos, title)
+    Stage graph (independent branches run concurrently)::
+
+        downloading -> enhancing* ---------+
+        fetching_stock -> normalizing -----+-> compiling -> cleanup
+        generating_thumbnail -> sizing_thumbnail (optional)
+
+    * skipped when FUSE_ENHANCEMENT applies the filters inside compiling,
+      and with STREAM_INGEST, where downloading pipes the audio through the
+      enhancer as it arrives and returns the enhanced file.
+
+    The thumbnail comes from fal.ai, or is drawn locally on a frame of the
+    first stock clip when fal is unconfigured, failing or too slow; only
+    that fallback waits for the stock clips.
+    sizing_thumbnail then encodes the JPEG variant each destination takes.
+
+    Once rendered, the job is handed to the publish queue and marked
+    "rendered"; it becomes "completed" when every destination has finished
+    ("failed" / "cancelled" if an upload did not go through), without
+    holding a scheduler slot meanwhile.
+
+    Stages checkpointed in the job's manifest by an earlier run are skipped,
+    so resuming after a restart or retrying continues from the failed stage.
+
+    With USE_REELS, fetching_stock waits for the audio and takes a pre-built
+    background reel long enough for it when there is one; the Pexels fetch
+    and normalization are then skipped and compiling only trims the reel
+    (reel maintenance keeps adding new clips to the library instead).
+    """
+    job = job_store.get(job_id)
+
+    async def download(r):
+        return await download_audio(audio_url, owner=job.id)
+
+    async def download_and_enhance(r):
+        return await download_enhanced(
+            audio_url, owner=job.id, on_progress=stage_progress(job, "downloading")
+        )
+
+    async def enhance(r):
+        return await enhance_audio(
+            r["downloading"], owner=job.id, on_progress=stage_progress(job, "enhancing")
+        )
+
+    async def fetch_stock(r):
+        if use_reels:
+            duration = (await probe(r["downloading"])).duration
+            reel = pick_reel(duration, owner=job.id)
+            if reel:
+                return [reel]
+        return await search_and_download_stock(count=stock_clip_count, owner=job.id)
+
+    async def normalize_stock(r):
+        clips = r["fetching_stock"]
+        if all(is_reel(c) for c in clips):
+            return clips
+        return await normalize_clips(clips, owner=job.id)
+
+    async def stock_clips(r):
+        # Raw clips, or the normalized ones when fetching was skipped on resume
+        return await r.wait("fetching_stock") or await r.wait(visual_dep)
+
+    async def thumbnail(r):
+        report: dict = {}
+        try:
+            # Only the fal request holds a network slot; the local fallback
+            # waits for the stock clips, which may need that slot themselves
+            path = await build_thumbnail(
+                title, thumbnail_prompt, clips=lambda: stock_clips(r), report=report,
+                slot=lambda: scheduler.slot("network", job.id),
+            )
+        except Exception as e:
+            job.thumbnail_path = f"Error: {e}"
+            raise
+        finally:
+            if report:
+                job.stages["generating_thumbnail"]["report"] = report
+        job.thumbnail_path = str(path)
+        return path
+
+    async def size_thumbnail(r):
+        # Publishers look these up by source hash, so they only hit the cache
+        if r["generating_thumbnail"] is None:
+            return []
+        return [
+            await thumbnail_variant(r["generating_thumbnail"], destination)
+            for destination in destinations
+        ]
+
+    async def compile_(r):
+        if settings.fuse_enhancement:
+            audio, audio_filter = r["downloading"], ENHANCE_FILTERS
+        else:
+            audio, audio_filter = r[audio_dep], ""
+        normalized = settings.use_mezzanine
+        report: dict = {}
+        output_video = await compile_video(
+            audio,
+            r["normalizing_stock"] if normalized else r["fetching_stock"],
+            title,
+            normalized=normalized,
+            audio_filter=audio_filter,
+            on_progress=stage_progress(job, "compiling"),
+            report=report,
+            gop_seconds=MEZZ_GOP / MEZZ_FPS if normalized else 0.0,
+        )
+        if report:
+            job.stages["compiling"]["report"] = report
         job.output_path = str(output_video)
+        return output_video
 
-        # Step 6: Publish to Telegram
-        job.step = "publishing"
-        job.progress = 80
+    async def cleanup(r):
+        # Source audio and stock clips stay in their shared caches (a repeat
+        # submission reuses them); just drop this job's references
+        _release_cached_files(job.id)
 
-        if publish_telegram:
-            try:
-                result = await publish_to_telegram(output_video, title, description, thumbnail_path)
-                job.telegram_result = str(result)
-            except Exception as e:
-                job.telegram_result = f"Error: {e}"
-
-        # Step 7: Cleanup temp files
-        job.step = "cleanup"
-        job.progress = 95
-        raw_audio.unlink(missing_ok=True)
-        for sv in stock_videos:
-            sv.unlink(missing_ok=True)
-
-        job.step = "done"
-        job.status = "completed"
-        job.progress = 100
+    use_reels = settings.use_reels and settings.use_mezzanine
+    destinations = []
+    if publish_telegram:
+        destinations.append("telegram")
+    if publish_youtube and settings.youtube_client_id:
+        destinations.append("youtube")
+    streaming = (
+        settings.stream_ingest and not settings.fuse_enhancement and can_stream(audio_url)
+    )
+    stages = [
+        Stage(
+            "downloading", download_and_enhance if streaming else download,
+            weight=30 if streaming else 15,
+            # A streaming download also runs the (network-paced) enhancement
+            # encode; it has its own class so it holds neither a network slot
+            # nor one of the scarce cpu slots for the whole transfer
+            resource="stream" if streaming else "network",
+        ),
+        Stage(
+            "fetching_stock", fetch_stock, deps=("downloading",) if use_reels else (),
+            weight=10, resource="network",
+        ),
+    ]
+    audio_dep = "downloading"
+    if not settings.fuse_enhancement and not streaming:
+        stages.append(Stage("enhancing", enhance, deps=("downloading",), weight=15, resource="cpu"))
+        audio_dep = "enhancing"
+    visual_dep = "fetching_stock"
+    if settings.use_mezzanine:
+        stages.append(Stage(
+            "normalizing_stock", normalize_stock, deps=("fetching_stock",), weight=10,
+            resource="cpu",
+        ))
+        visual_dep = "normalizing_stock"
+    if generate_thumb:
+        stages.append(Stage("generating_thumbnail", thumbnail, optional=True, weight=5))
+        if destinations:
+            stages.append(Stage(
+                "sizing_thumbnail", size_thumbnail, deps=("generating_thumbnail",),
+                optional=True, weight=2,
+            ))
+    stages.append(Stage(
+        "compiling", compile_, deps=(audio_dep, visual_dep), weight=30, resource="cpu"
+    ))
+    stages.append(Stage("cleanup", cleanup, deps=("compiling",), weight=5))
 
+    job.status = "running"
+    job.error = ""
+    job_store.save(job)
+    try:
+        await run_stages(job, stages)
+        for destination in destinations:
+            stage, _ = DESTINATIONS[destination]
+            info = job.stages.get(stage, {})
+            if info.get("status") != "done":
+                job.stages[stage] = {"status": "queued", "progress": 0, "weight": 10, "error": ""}
+        if destinations:
+            job.step = "publishing"
+            job.status = "rendered"
+        else:
+            job.step = "done"
+            job.status = "completed"
+            job.progress = 100
+    except asyncio.CancelledError:
+        job.status = "cancelled"
+        job.error = "Cancelled"
+        raise
     except Exception as e:
         job.status = "failed"
         job.error = str(e)
+    finally:
+        _release_cached_files(job.id)
+        if job.status == "rendered":
+            publish_queue.enqueue(job.id, destinations, job=job)
+        else:
+            job_store.save(job)
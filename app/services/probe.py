@@ -0,0 +1,125 @@
+import asyncio
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from fractions import Fraction
+from pathlib import Path
+
+from app.config import settings
+from app.services.coalesce import Coalescer
+from app.services.ffmpeg import run_process
+
+CACHE_SIZE = 2048
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """Subset of ffprobe output the pipeline makes decisions on."""
+    duration: float
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    video_codec: str = ""
+    pix_fmt: str = ""
+    time_base: str = ""
+    nb_frames: int = 0
+    audio_codec: str = ""
+    sample_rate: int = 0
+    channels: int = 0
+
+    @property
+    def has_video(self) -> bool:
+        return bool(self.video_codec)
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.audio_codec)
+
+
+# (path, size, mtime_ns) -> MediaInfo. A changed file gets a new key, so
+# entries never go stale; the oldest are dropped beyond CACHE_SIZE.
+_cache: OrderedDict[tuple, MediaInfo] = OrderedDict()
+_probes = Coalescer()
+_semaphore: asyncio.Semaphore | None = None
+
+
+def _cache_key(path: Path) -> tuple:
+    st = path.stat()
+    return (str(path.resolve()), st.st_size, st.st_mtime_ns)
+
+
+def _parse_rate(rate: str) -> float:
+    try:
+        value = Fraction(rate)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+    return float(value)
+
+
+def _parse(raw: dict) -> MediaInfo:
+    fmt = raw.get("format", {})
+    streams = raw.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+    duration = fmt.get("duration") or video.get("duration") or audio.get("duration")
+    if not duration:
+        raise RuntimeError("ffprobe returned no duration")
+    return MediaInfo(
+        duration=float(duration),
+        width=int(video.get("width", 0)),
+        height=int(video.get("height", 0)),
+        fps=_parse_rate(video.get("avg_frame_rate") or video.get("r_frame_rate") or "0"),
+        video_codec=video.get("codec_name", ""),
+        pix_fmt=video.get("pix_fmt", ""),
+        time_base=video.get("time_base", ""),
+        nb_frames=int(video.get("nb_frames", 0) or 0),
+        audio_codec=audio.get("codec_name", ""),
+        sample_rate=int(audio.get("sample_rate", 0) or 0),
+        channels=int(audio.get("channels", 0) or 0),
+    )
+
+
+async def _run_ffprobe(path: Path) -> MediaInfo:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.probe_concurrency)
+
+    # No -nostdin here: unlike ffmpeg, ffprobe rejects it
+    cmd = [
+        "ffprobe", "-v", "quiet",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        str(path),
+    ]
+    async with _semaphore:
+        try:
+            _, stdout, _ = await run_process(cmd, timeout=30)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"ffprobe timed out for: {path.name}")
+
+    try:
+        return _parse(json.loads(stdout.decode() or "{}"))
+    except (ValueError, RuntimeError):
+        raise RuntimeError(f"Could not read media info for: {path.name}")
+
+
+async def probe(path: Path) -> MediaInfo:
+    """Probe a media file, served from cache when the file is unchanged."""
+    key = _cache_key(path)
+    info = _cache.get(key)
+    if info is not None:
+        _cache.move_to_end(key)
+        return info
+
+    # Coalesce concurrent probes of the same file into one ffprobe run
+    info = await _probes.run(key, lambda: _run_ffprobe(path))
+
+    _cache[key] = info
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return info
+
+
+async def probe_many(paths: list[Path]) -> list[MediaInfo]:
+    """Probe several files concurrently (bounded by PROBE_CONCURRENCY)."""
+    return list(await asyncio.gather(*(probe(p) for p in paths)))
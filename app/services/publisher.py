@@ -0,0 +1,287 @@
+import asyncio
+import random
+import time
+import uuid
+from contextlib import suppress
+from pathlib import Path
+
+from app.config import settings
+from app.services.db import get_conn, transaction
+from app.services.jobstore import WORKER_ID, JobStatus, job_store
+from app.services.telegram_pub import publish_to_telegram
+from app.services.youtube_pub import publish_to_youtube
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS publish_tasks (
+    id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    worker TEXT NOT NULL DEFAULT '',
+    error TEXT NOT NULL DEFAULT '',
+    result TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    UNIQUE (job_id, destination)
+);
+CREATE INDEX IF NOT EXISTS idx_publish_tasks_due ON publish_tasks (status, next_attempt_at);
+"""
+
+# Destination -> (job stage it is reported under, JobStatus result field)
+DESTINATIONS = {
+    "telegram": ("publishing", "telegram_result"),
+    "youtube": ("publishing_youtube", "youtube_result"),
+}
+TERMINAL_STATUSES = ("done", "failed", "cancelled")
+
+# Idle workers re-check the table this often (tasks queued by other processes)
+POLL_INTERVAL = 5
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+
+
+class PublishQueue:
+    """Persistent outbound queue for publishing rendered videos.
+
+    Each (job, destination) pair is a row in ``publish_tasks``, worked by a
+    pool of ``PUBLISH_WORKERS`` tasks per process, separate from the job
+    scheduler, so slow uploads never hold an encode slot. Failed attempts
+    are retried with exponential backoff up to ``PUBLISH_MAX_ATTEMPTS``.
+    Once every destination of a job has finished the job goes from
+    "rendered" to "completed", or to "failed" / "cancelled" when any of
+    its uploads did not go through (retrying re-sends only those).
+    """
+
+    def __init__(self):
+        self._workers: list[asyncio.Task] = []
+        self._running: dict[str, asyncio.Task] = {}
+        self._wake = asyncio.Event()
+
+    @property
+    def conn(self):
+        return get_conn(SCHEMA)
+
+    @property
+    def jobs(self) -> set[str]:
+        """Ids of jobs with a publish attempt running in this process."""
+        return {key.split(":", 1)[0] for key in self._running}
+
+    def start(self):
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(max(1, settings.publish_workers))
+        ]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        with suppress(asyncio.CancelledError):
+            await asyncio.gather(*self._workers)
+        self._workers = []
+
+    def enqueue(self, job_id: str, destinations: list[str], job: JobStatus | None = None):
+        """Queue ``destinations`` for a rendered job; ones already published are kept as is.
+
+        ``job`` is saved in the same transaction, so a job never shows as
+        "rendered" without its publish tasks.
+        """
+        now = time.time()
+        with transaction(self.conn) as conn:
+            if job is not None:
+                job_store.save(job)
+            for destination in destinations:
+                conn.execute(
+                    "INSERT INTO publish_tasks "
+                    "(id, job_id, destination, status, next_attempt_at, created_at) "
+                    "VALUES (?, ?, ?, 'pending', ?, ?) "
+                    "ON CONFLICT(job_id, destination) DO UPDATE SET status='pending', "
+                    "attempts=0, next_attempt_at=excluded.next_attempt_at, error='' "
+                    "WHERE publish_tasks.status IN ('failed', 'cancelled')",
+                    (uuid.uuid4().hex[:12], job_id, destination, now, now),
+                )
+        self._wake.set()
+        # Nothing left to send (e.g. a retried job that was fully published)
+        self._finalize(job_id)
+
+    def cancel(self, job_id: str):
+        """Drop a job's unfinished publish tasks, stopping any this process is running."""
+        rows = self.conn.execute(
+            "UPDATE publish_tasks SET status='cancelled', error='Cancelled' "
+            "WHERE job_id = ? AND status = 'pending' RETURNING destination",
+            (job_id,),
+        ).fetchall()
+
+        def mark(j: JobStatus):
+            for r in rows:
+                j.stages.setdefault(DESTINATIONS[r["destination"]][0], {})["status"] = "cancelled"
+        job_store.update(job_id, mark)
+        for task_id, task in list(self._running.items()):
+            if task_id.startswith(f"{job_id}:"):
+                task.cancel()
+        # Attempts running in another worker process are stopped by its
+        # cancel-request poll
+        remote = self.conn.execute(
+            "SELECT 1 FROM publish_tasks WHERE job_id = ? AND status = 'running' "
+            "AND worker != ?",
+            (job_id, WORKER_ID),
+        ).fetchone()
+        if remote:
+            job_store.request_cancel(job_id)
+        self._finalize(job_id)
+
+    def _claim(self) -> dict | None:
+        now = time.time()
+        with transaction(self.conn) as conn:
+            # Attempts cut off by a dead worker are picked up again
+            conn.execute(
+                "UPDATE publish_tasks SET status='pending', worker='' WHERE status='running' "
+                "AND worker NOT IN (SELECT id FROM workers)"
+            )
+            row = conn.execute(
+                "SELECT * FROM publish_tasks WHERE status='pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE publish_tasks SET status='running', worker=?, attempts=attempts+1 "
+                "WHERE id = ?",
+                (WORKER_ID, row["id"]),
+            )
+        return {**dict(row), "attempts": row["attempts"] + 1}
+
+    async def _work(self):
+        while True:
+            task = self._claim()
+            if task is None:
+                self._wake.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), timeout=POLL_INTERVAL)
+                continue
+            key = f"{task['job_id']}:{task['destination']}"
+            run = asyncio.create_task(self._attempt(task))
+            self._running[key] = run
+            try:
+                await asyncio.shield(run)
+            except asyncio.CancelledError:
+                if not run.done():
+                    # Worker shutdown: stop the upload and hand the task back
+                    run.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await run
+                    self.conn.execute(
+                        "UPDATE publish_tasks SET status='pending', worker='', "
+                        "attempts=attempts-1 WHERE id = ?",
+                        (task["id"],),
+                    )
+                    raise
+            finally:
+                self._running.pop(key, None)
+
+    async def _attempt(self, task: dict):
+        job_id, destination = task["job_id"], task["destination"]
+        stage, field = DESTINATIONS[destination]
+        job = job_store.get(job_id)
+        if job is None or not job.output_path:
+            self._set_task(task["id"], "cancelled", error="Job or output missing")
+            return
+
+        def set_stage(**info):
+            def apply(j: JobStatus):
+                j.stages.setdefault(stage, {}).update(info)
+            job_store.update(job_id, apply)
+
+        set_stage(status="running", attempts=task["attempts"], error="")
+        try:
+            result = await self._publish(destination, job, set_stage)
+        except asyncio.CancelledError:
+            self._set_task(task["id"], "cancelled", error="Cancelled")
+            set_stage(status="cancelled")
+            self._finalize(job_id)
+            raise
+        except Exception as e:
+            if task["attempts"] < settings.publish_max_attempts:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (task["attempts"] - 1))
+                delay *= 1 + random.random() * 0.1
+                self._set_task(task["id"], "pending", error=str(e), delay=delay)
+                set_stage(status="retrying", error=str(e))
+                return
+            self._set_task(task["id"], "failed", error=str(e))
+
+            def fail(j: JobStatus):
+                j.stages.setdefault(stage, {}).update(status="failed", error=str(e))
+                setattr(j, field, f"Error: {e}")
+            job_store.update(job_id, fail)
+        else:
+            self._set_task(task["id"], "done", result=result)
+
+            def done(j: JobStatus):
+                j.stages.setdefault(stage, {}).update(status="done", progress=100)
+                setattr(j, field, result)
+            job_store.update(job_id, done)
+        self._finalize(job_id)
+
+    @staticmethod
+    async def _publish(destination: str, job: JobStatus, set_stage) -> str:
+        video = Path(job.output_path)
+        title = job.params.get("title", "")
+        description = job.params.get("description", "")
+        thumb = None
+        if job.thumbnail_path and not job.thumbnail_path.startswith("Error"):
+            thumb = Path(job.thumbnail_path)
+        if destination == "telegram":
+            return await publish_to_telegram(video, title, description, thumb)
+
+        last = 0
+
+        def progress(fraction: float):
+            nonlocal last
+            pct = int(fraction * 100)
+            if pct > last:
+                last = pct
+                set_stage(progress=pct)
+
+        return await publish_to_youtube(
+            video, title, description, thumbnail_path=thumb, on_progress=progress
+        )
+
+    def _set_task(self, task_id: str, status: str, error: str = "", result: str = "",
+                  delay: float = 0.0):
+        self.conn.execute(
+            "UPDATE publish_tasks SET status=?, error=?, result=?, worker='', "
+            "next_attempt_at=? WHERE id = ?",
+            (status, error, result, time.time() + delay, task_id),
+        )
+
+    def _finalize(self, job_id: str):
+        """Finish a rendered job once all of its destinations are finished."""
+        rows = self.conn.execute(
+            "SELECT destination, status, error FROM publish_tasks WHERE job_id = ?", (job_id,)
+        ).fetchall()
+        if not rows or any(r["status"] not in TERMINAL_STATUSES for r in rows):
+            return
+        failed = [r for r in rows if r["status"] == "failed"]
+        cancelled = [r for r in rows if r["status"] == "cancelled"]
+
+        def complete(j: JobStatus):
+            if j.status != "rendered":
+                return
+            if failed:
+                j.status = "failed"
+                j.error = "Publishing failed: " + "; ".join(
+                    f"{r['destination']}: {r['error']}" for r in failed
+                )
+            elif cancelled:
+                j.status = "cancelled"
+                j.error = "Publishing cancelled: " + ", ".join(r["destination"] for r in cancelled)
+            else:
+                j.status = "completed"
+                j.step = "done"
+                j.progress = 100
+        job_store.update(job_id, complete)
+        # A cancel request left for a finished job must not hit its retry
+        job_store.take_cancel_requests([job_id])
+
+
+publish_queue = PublishQueue()
@@ -0,0 +1,155 @@
+import logging
+import random
+import time
+import uuid
+from pathlib import Path
+
+from app.config import settings
+from app.services.compiler import _write_concat_list
+from app.services.ffmpeg import run_ffmpeg
+from app.services.filecache import FileCache
+from app.services.jobstore import job_store
+from app.services.mezzanine import MEZZ_FPS, MEZZ_TAG, mezzanine_cache, normalize_clips
+from app.services.pexels import clip_library, search_and_download_stock
+
+logger = logging.getLogger(__name__)
+
+# A reel is only worth building from a reasonably varied pool of clips
+MIN_REEL_CLIPS = 3
+
+# Long visual masters joined from mezzanine clips. They share the mezzanine
+# stream layout (keyframe every GOP), so a job cuts one to length with the
+# concat demuxer and `-c copy`.
+reel_library = FileCache("reels", lambda: settings.reel_cache_bytes)
+
+
+def is_reel(path: Path) -> bool:
+    return path.parent == settings.reels_dir
+
+
+def pick_reel(duration: float, owner: str) -> Path | None:
+    """Take the least recently used reel covering ``duration`` seconds, referenced by ``owner``."""
+    for entry in reversed(reel_library.entries()):
+        if entry.meta.get("duration", 0) < duration:
+            continue
+        if reel_library.get(entry.key, owner=owner):
+            return entry.path
+    return None
+
+
+def _reel_order(clips: list[tuple[Path, float]], seconds: float) -> list[Path]:
+    """Shuffled rounds over ``clips`` until ``seconds`` are covered, never repeating back to back."""
+    order: list[Path] = []
+    total = 0.0
+    while total < seconds:
+        batch = random.sample(clips, len(clips))
+        if order and batch[0][0] == order[-1]:
+            batch.append(batch.pop(0))
+        for path, duration in batch:
+            order.append(path)
+            total += duration
+            if total >= seconds:
+                break
+    return order
+
+
+async def build_reel(minutes: int) -> Path | None:
+    """Join cached mezzanine clips into a ``minutes``-long reel (stream copy only).
+
+    Returns None when the mezzanine library is too small to make one.
+    """
+    settings.ensure_dirs()
+    owner = f"reel-{uuid.uuid4().hex[:8]}"
+    clips = []
+    for entry in mezzanine_cache.entries():
+        if entry.meta.get("frames") and mezzanine_cache.get(entry.key, owner=owner):
+            clips.append((entry.path, entry.meta["frames"] / MEZZ_FPS))
+    key = f"{owner}@{MEZZ_TAG}"
+    list_path = settings.reels_dir / f"{owner}.txt"
+    out_path = settings.reels_dir / f"{key}.mp4"
+    part_path = out_path.with_suffix(".part.mp4")
+    try:
+        if len(clips) < MIN_REEL_CLIPS:
+            return None
+        order = _reel_order(clips, minutes * 60)
+        durations = dict(clips)
+        _write_concat_list(list_path, order)
+        cmd = [
+            "ffmpeg", "-y", "-nostdin",
+            "-f", "concat", "-safe", "0",
+            "-i", str(list_path),
+            "-map", "0:v:0", "-c:v", "copy",
+            "-an",
+            str(part_path),
+        ]
+        try:
+            await run_ffmpeg(cmd, timeout=3600, label="Reel build")
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        part_path.replace(out_path)
+    finally:
+        list_path.unlink(missing_ok=True)
+        mezzanine_cache.release_owner(owner)
+
+    reel_library.put(key, out_path, meta={
+        "duration": sum(durations[p] for p in order),
+        "clips": len(order),
+        "built_at": time.time(),
+    })
+    return out_path
+
+
+async def top_up_clips(count: int):
+    """Fetch ``count`` new stock clips into the mezzanine library.
+
+    Jobs served from a reel never search Pexels themselves, so this is what
+    keeps rebuilt reels gaining variety.
+    """
+    if count <= 0 or not settings.pexels_api_key:
+        return
+    owner = f"reel-{uuid.uuid4().hex[:8]}"
+    try:
+        clips = await search_and_download_stock(count=count, owner=owner)
+        await normalize_clips(clips, owner=owner)
+    finally:
+        clip_library.release_owner(owner)
+        mezzanine_cache.release_owner(owner)
+
+
+async def maintain_reels():
+    """Top the pool up to ``REEL_COUNT`` fresh reels and retire the oldest beyond that.
+
+    Runs in one worker process at a time (the "reels" lease); other workers
+    skip the pass. Reels still referenced by a running job are kept until a
+    later pass.
+    """
+    if not job_store.take_lease("reels"):
+        return
+    try:
+        await _maintain_reels()
+    finally:
+        job_store.release_lease("reels")
+
+
+async def _maintain_reels():
+    max_age = settings.reel_rebuild_hours * 3600
+
+    def fresh():
+        now = time.time()
+        return [e for e in reel_library.entries() if now - e.meta.get("built_at", 0) < max_age]
+
+    if len(fresh()) < settings.reel_count:
+        try:
+            await top_up_clips(settings.reel_topup_clips)
+        except Exception:
+            logger.exception("Stock clip top-up failed; building reels from the current library")
+    while len(fresh()) < settings.reel_count:
+        if await build_reel(settings.reel_minutes) is None:
+            break
+
+    newest_first = sorted(
+        reel_library.entries(), key=lambda e: e.meta.get("built_at", 0), reverse=True
+    )
+    for entry in newest_first[settings.reel_count:]:
+        reel_library.discard(entry.key)
@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+from app.config import settings
+
+
+class ResourcePool:
+    """Semaphore whose waiters are served in (priority, arrival) order."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self._waiters: list[tuple[tuple, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, key: tuple = ()):
+        if self.in_use < self.limit and not self.waiting:
+            self.in_use += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (key, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Slot was handed over just as we got cancelled: give it back.
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_use < self.limit:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.in_use += 1
+            fut.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, key: tuple = ()):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class JobScheduler:
+    """Bounded job queue with per-resource-class concurrency limits.
+
+    At most ``max_jobs`` pipelines run at once; the rest wait in a priority
+    queue (higher priority first, then FIFO). Inside a running pipeline each
+    stage additionally takes a slot from its resource class (``network``,
+    ``cpu`` or ``stream``), so one job waiting on the network never holds an
+    encode slot.
+    """
+
+    def __init__(self, max_jobs: int, limits: dict[str, int]):
+        self.max_jobs = max(1, max_jobs)
+        self.pools = {name: ResourcePool(name, limit) for name, limit in limits.items()}
+        self.running: dict[str, asyncio.Task] = {}
+        self._queue: list[tuple[tuple, str, Callable[[], Awaitable]]] = []
+        self._keys: dict[str, tuple] = {}
+        self._seq = itertools.count()
+
+    def submit(self, job_id: str, factory: Callable[[], Awaitable], priority: int = 0):
+        """Queue a job; ``factory`` is called to create its coroutine when it starts."""
+        key = (-priority, next(self._seq))
+        self._keys[job_id] = key
+        heapq.heappush(self._queue, (key, job_id, factory))
+        self._maybe_start()
+
+    @property
+    def queued(self) -> list[str]:
+        """Ids of jobs waiting for admission."""
+        return [job_id for _, job_id, _ in self._queue]
+
+    def position(self, job_id: str) -> int | None:
+        """1-based position in the admission queue, or None if not queued."""
+        queued = sorted(entry[0] for entry in self._queue)
+        key = self._keys.get(job_id)
+        if key is None or job_id in self.running:
+            return None
+        try:
+            return queued.index(key) + 1
+        except ValueError:
+            return None
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a queued job or cancel a running one. Returns False if unknown here.
+
+        A running pipeline gets CancelledError, which releases its stage
+        slots as it unwinds and frees its admission slot when it ends.
+        """
+        task = self.running.get(job_id)
+        if task is not None:
+            task.cancel()
+            return True
+        for i, entry in enumerate(self._queue):
+            if entry[1] == job_id:
+                self._queue.pop(i)
+                heapq.heapify(self._queue)
+                self._keys.pop(job_id, None)
+                return True
+        return False
+
+    def slot(self, resource: str, job_id: str):
+        """Context manager holding one ``resource`` slot on behalf of ``job_id``."""
+        return self.pools[resource].slot(self._keys.get(job_id, ()))
+
+    def _maybe_start(self):
+        while self._queue and len(self.running) < self.max_jobs:
+            _, job_id, factory = heapq.heappop(self._queue)
+            task = asyncio.ensure_future(factory())
+            self.running[job_id] = task
+            task.add_done_callback(lambda _t, jid=job_id: self._finished(jid))
+
+    def _finished(self, job_id: str):
+        self.running.pop(job_id, None)
+        self._keys.pop(job_id, None)
+        self._maybe_start()
+
+
+scheduler = JobScheduler(
+    max_jobs=settings.max_concurrent_jobs,
+    limits={
+        "network": settings.network_concurrency,
+        "cpu": settings.cpu_concurrency,
+        "stream": settings.stream_concurrency,
+    },
+)
@@ -1,10 +1,99 @@
 import asyncio
+import time
 from pathlib import Path
 
-from telegram import Bot
+from telegram import Bot, Message
 from telegram.constants import ParseMode
+from telegram.request import HTTPXRequest
 
 from app.config import settings
+from app.services.db import get_conn
+from app.services.thumbnail import thumbnail_variant
+
+# Bot API upload limits: 50 MB on api.telegram.org, 2000 MB on a local Bot API server
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_UPLOAD_LIMIT = 2000 * 1024 * 1024
+
+# Uploaded files by content identity, so re-posting the same file sends its
+# file_id instead of the bytes. file_ids are only valid for the bot that
+# uploaded them, hence the bot id in the key.
+FILE_ID_SCHEMA = """
+CREATE TABLE IF NOT EXISTS telegram_files (
+    key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_bot: Bot | None = None
+# Publish workers may ask for the bot at the same time; only one builds it
+_bot_lock = asyncio.Lock()
+
+
+async def get_bot() -> Bot:
+    """Shared Bot for the app's lifetime, with a pooled HTTP connection.
+
+    ``TELEGRAM_BASE_URL`` points it at a self-hosted Bot API server; with
+    ``TELEGRAM_LOCAL_MODE`` the server reads uploads straight from the local
+    file path (it must see the same media directory).
+    """
+    global _bot
+    async with _bot_lock:
+        if _bot is None:
+            _bot = await _create_bot()
+    return _bot
+
+
+async def _create_bot() -> Bot:
+    kwargs = {}
+    if settings.telegram_base_url:
+        base = settings.telegram_base_url.rstrip("/")
+        kwargs["base_url"] = f"{base}/bot"
+        kwargs["base_file_url"] = f"{base}/file/bot"
+    bot = Bot(
+        token=settings.telegram_bot_token,
+        request=HTTPXRequest(
+            connection_pool_size=settings.telegram_pool_size,
+            read_timeout=300,
+            write_timeout=300,
+            media_write_timeout=300,
+        ),
+        local_mode=settings.telegram_local_mode,
+        **kwargs,
+    )
+    await bot.initialize()
+    return bot
+
+
+async def close_bot():
+    global _bot
+    if _bot is not None:
+        await _bot.shutdown()
+        _bot = None
+
+
+def _file_key(path: Path) -> str:
+    st = path.stat()
+    bot_id = settings.telegram_bot_token.split(":", 1)[0]
+    return f"{bot_id}:{path.resolve()}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _cached_file_id(path: Path) -> str | None:
+    row = get_conn(FILE_ID_SCHEMA).execute(
+        "SELECT file_id FROM telegram_files WHERE key = ?", (_file_key(path),)
+    ).fetchone()
+    return row["file_id"] if row else None
+
+
+def _remember_file_id(path: Path, msg: Message):
+    media = msg.video or msg.document
+    if media is None:
+        return
+    get_conn(FILE_ID_SCHEMA).execute(
+        "INSERT INTO telegram_files (key, file_id, created_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET file_id=excluded.file_id, created_at=excluded.created_at",
+        (_file_key(path), media.file_id, time.time()),
+    )
 
 
 async def publish_to_telegram(
@@ -13,13 +102,19 @@ async def publish_to_telegram(
     description: str = "",
     thumbnail_path: Path | None = None,
 ) -> str:
-    """Upload video to Telegram channel/chat."""
+    """Upload video to Telegram channel/chat.
+
+    A video posted before by the same bot is re-sent by ``file_id``. The
+    Bot API never accepts a ``file_id`` for thumbnails, so those are always
+    uploaded (by path in local mode), as the small "telegram" JPEG variant.
+    """
     token = settings.telegram_bot_token
     chat_id = settings.telegram_chat_id
     if not token or not chat_id:
         raise ValueError("TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID required")
 
-    bot = Bot(token=token)
+    bot = await get_bot()
+    local = settings.telegram_local_mode
 
     caption = f"🙏 *{title}*"
     if description:
@@ -27,37 +122,45 @@ async def publish_to_telegram(
     caption += "\n\n🎙 Dhamma Audio → Video"
 
     file_size = video_path.stat().st_size
-    thumb_file = None
+    limit = LOCAL_UPLOAD_LIMIT if settings.telegram_base_url else CLOUD_UPLOAD_LIMIT
+    file_id = _cached_file_id(video_path)
+
+    opened = []
+
+    def media(path: Path):
+        # Local mode sends a file:// URI; otherwise the bytes are uploaded
+        if local:
+            return path
+        f = open(path, "rb")
+        opened.append(f)
+        return f
+
+    thumb = None
     if thumbnail_path and thumbnail_path.exists():
-        thumb_file = open(thumbnail_path, "rb")
+        thumb = media(await thumbnail_variant(thumbnail_path, "telegram"))
 
     try:
-        # Telegram limit: 50MB for bots
-        if file_size > 50 * 1024 * 1024:
-            async with bot:
-                msg = await bot.send_document(
-                    chat_id=chat_id,
-                    document=open(video_path, "rb"),
-                    thumbnail=thumb_file,
-                    caption=caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    read_timeout=300,
-                    write_timeout=300,
-                )
+        if file_size > limit:
+            msg = await bot.send_document(
+                chat_id=chat_id,
+                document=file_id or media(video_path),
+                thumbnail=thumb,
+                caption=caption,
+                parse_mode=ParseMode.MARKDOWN,
+            )
         else:
-            async with bot:
-                msg = await bot.send_video(
-                    chat_id=chat_id,
-                    video=open(video_path, "rb"),
-                    thumbnail=thumb_file,
-                    caption=caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    supports_streaming=True,
-                    read_timeout=300,
-                    write_timeout=300,
-                )
+            msg = await bot.send_video(
+                chat_id=chat_id,
+                video=file_id or media(video_path),
+                thumbnail=thumb,
+                caption=caption,
+                parse_mode=ParseMode.MARKDOWN,
+                supports_streaming=True,
+            )
     finally:
-        if thumb_file:
-            thumb_file.close()
+        for f in opened:
+            f.close()
 
+    if not file_id:
+        _remember_file_id(video_path, msg)
     return f"Telegram message sent: {msg.message_id}"
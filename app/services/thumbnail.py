@@ -1,13 +1,53 @@
 import asyncio
+import hashlib
+import time
+import unicodedata
 import uuid
+from contextlib import nullcontext
 from pathlib import Path
-
-import httpx
+from typing import AsyncContextManager, Awaitable, Callable
 
 from app.config import settings
+from app.services.compiler import _escape_drawtext, _find_font
+from app.services.db import get_conn
+from app.services.ffmpeg import run_process
+from app.services.filecache import FileCache
+from app.services.http import get_client
+from app.services.probe import probe
 
 FAL_RUN_URL = "https://fal.run"
 
+# Generated images, keyed by SHA-256 of the prompt they were made from
+thumbnail_images = FileCache("thumbnails", lambda: settings.thumb_cache_bytes)
+
+# LLM image prompts by normalized title, so a repeat title skips the LLM call
+PROMPT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnail_prompts (
+    title_key TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+DOWNLOAD_CHUNK = 256 * 1024
+
+# Local fallback: YouTube's recommended thumbnail size, frame taken this far in
+LOCAL_SIZE = (1280, 720)
+LOCAL_FRAME_SECONDS = 3.0
+
+# Per-publisher JPEG derivatives: (max width, max height, max bytes)
+VARIANTS = {
+    # Bot API thumbnails: JPEG, at most 320 px per side, under 200 KB
+    "telegram": (320, 320, 200 * 1000),
+    # thumbnails.set rejects files of 2 MB or more
+    "youtube": (1280, 720, 2 * 1024**2),
+}
+# ffmpeg -q:v values tried in turn until the JPEG fits, best quality first
+JPEG_QUALITIES = (2, 4, 7, 11, 16, 23, 31)
+
+# Derivatives, keyed by "<variant>:<SHA-256 of the source image>"
+thumbnail_variants = FileCache("thumbnail_variants", lambda: settings.thumb_cache_bytes)
+
 # System prompt for the LLM to generate image prompts
 PROMPT_SYSTEM = (
     "You are an expert at writing image generation prompts for Buddhist-themed YouTube thumbnails. "
@@ -19,50 +59,80 @@ PROMPT_SYSTEM = (
 )
 
 
+def _title_key(title: str) -> str:
+    """Normalized title for the prompt cache: NFC, case-folded, whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", title).casefold().split())
+
+
 async def _generate_image_prompt(title: str) -> str:
     """Use fal.ai OpenRouter (Gemini) to generate an optimized image prompt from the title."""
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(
-            f"{FAL_RUN_URL}/openrouter/router/openai/v1/chat/completions",
-            headers={
-                "Authorization": f"Key {settings.fal_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "google/gemini-2.5-flash",
-                "messages": [
-                    {"role": "system", "content": PROMPT_SYSTEM},
-                    {"role": "user", "content": f"Generate a thumbnail image prompt for this Dhamma talk: {title}"},
-                ],
-            },
-        )
-        resp.raise_for_status()
-        data = resp.json()
+    conn = get_conn(PROMPT_SCHEMA)
+    key = _title_key(title)
+    row = conn.execute(
+        "SELECT prompt FROM thumbnail_prompts WHERE title_key = ?", (key,)
+    ).fetchone()
+    if row:
+        return row["prompt"]
+
+    resp = await get_client().post(
+        f"{FAL_RUN_URL}/openrouter/router/openai/v1/chat/completions",
+        headers={
+            "Authorization": f"Key {settings.fal_key}",
+            "Content-Type": "application/json",
+        },
+        json={
+            "model": "google/gemini-2.5-flash",
+            "messages": [
+                {"role": "system", "content": PROMPT_SYSTEM},
+                {"role": "user", "content": f"Generate a thumbnail image prompt for this Dhamma talk: {title}"},
+            ],
+        },
+        timeout=60,
+    )
+    resp.raise_for_status()
+    prompt = resp.json()["choices"][0]["message"]["content"].strip()
 
-    return data["choices"][0]["message"]["content"].strip()
+    conn.execute(
+        "INSERT INTO thumbnail_prompts (title_key, prompt, created_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(title_key) DO UPDATE SET prompt=excluded.prompt",
+        (key, prompt, time.time()),
+    )
+    return prompt
 
 
 async def _generate_image(prompt: str) -> str:
     """Use fal.ai nano-banana-pro to generate a thumbnail image. Returns the image URL."""
-    async with httpx.AsyncClient(timeout=120) as client:
-        # Submit to queue
-        resp = await client.post(
-            f"{FAL_RUN_URL}/fal-ai/nano-banana-pro",
-            headers={
-                "Authorization": f"Key {settings.fal_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "prompt": prompt,
-                "aspect_ratio": "16:9",
-                "num_images": 1,
-                "output_format": "png",
-            },
-        )
-        resp.raise_for_status()
-        data = resp.json()
+    resp = await get_client().post(
+        f"{FAL_RUN_URL}/fal-ai/nano-banana-pro",
+        headers={
+            "Authorization": f"Key {settings.fal_key}",
+            "Content-Type": "application/json",
+        },
+        json={
+            "prompt": prompt,
+            "aspect_ratio": "16:9",
+            "num_images": 1,
+            "output_format": "png",
+        },
+        timeout=120,
+    )
+    resp.raise_for_status()
+    return resp.json()["images"][0]["url"]
+
 
-    return data["images"][0]["url"]
+async def _download_image(url: str, out_path: Path):
+    """Stream ``url`` to ``out_path`` via a ``.part`` file."""
+    part_path = out_path.with_suffix(".part")
+    try:
+        async with get_client().stream("GET", url, timeout=120) as resp:
+            resp.raise_for_status()
+            with open(part_path, "wb") as f:
+                async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    part_path.replace(out_path)
 
 
 async def generate_thumbnail(
@@ -73,8 +143,9 @@ async def generate_thumbnail(
 
     Flow:
         1. If no custom prompt, use OpenRouter (Gemini) to generate one from the title
-        2. Use nano-banana-pro to generate the image
-        3. Download and save the image
+           (cached per normalized title)
+        2. Reuse the image already generated from that prompt, if cached
+        3. Otherwise generate one with nano-banana-pro and stream it to disk
 
     Args:
         title: The Dhamma talk title.
@@ -93,16 +164,120 @@ async def generate_thumbnail(
     else:
         image_prompt = await _generate_image_prompt(title)
 
+    key = hashlib.sha256(image_prompt.encode()).hexdigest()
+    entry = thumbnail_images.get(key)
+    if entry:
+        return entry.path
+
     # Step 2: Generate image with nano-banana-pro
     image_url = await _generate_image(image_prompt)
 
     # Step 3: Download the generated image
-    job_id = uuid.uuid4().hex[:8]
-    out_path = settings.thumbs_dir / f"{job_id}_thumbnail.png"
+    out_path = settings.thumbs_dir / f"{key[:16]}_thumbnail.png"
+    await _download_image(image_url, out_path)
+    thumbnail_images.put(key, out_path, meta={"prompt": image_prompt})
+    return out_path
+
+
+async def local_thumbnail(title: str, clips: list[Path]) -> Path:
+    """Build a thumbnail locally: a frame from the first stock clip with the title on it.
 
-    async with httpx.AsyncClient(timeout=120, follow_redirects=True) as client:
-        img_resp = await client.get(image_url)
-        img_resp.raise_for_status()
-        out_path.write_bytes(img_resp.content)
+    Needs no network; one input-seeked frame decode, well under a second.
+    """
+    settings.ensure_dirs()
+    if not clips:
+        raise ValueError("No stock clips to take a thumbnail frame from")
+    clip = clips[0]
+    duration = (await probe(clip)).duration
+    at = min(LOCAL_FRAME_SECONDS, duration / 2) if duration > 0 else 0.0
 
+    width, height = LOCAL_SIZE
+    vf = (
+        f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+        f"crop={width}:{height},setsar=1"
+    )
+    font_path = _find_font()
+    if title and font_path:
+        vf += (
+            f",drawtext=text='{_escape_drawtext(title)}':fontfile={font_path}"
+            ":fontsize=64:fontcolor=white:borderw=4:bordercolor=black"
+            ":x=(w-text_w)/2:y=(h-text_h)/2"
+        )
+
+    out_path = settings.thumbs_dir / f"{uuid.uuid4().hex[:8]}_thumbnail.png"
+    cmd = [
+        "ffmpeg", "-y", "-ss", f"{at:.2f}", "-i", str(clip),
+        "-frames:v", "1", "-vf", vf, str(out_path),
+    ]
+    returncode, _, stderr = await run_process(cmd, timeout=30)
+    if returncode != 0 or not out_path.exists():
+        out_path.unlink(missing_ok=True)
+        raise RuntimeError(f"Thumbnail frame grab failed: {stderr.decode()[-500:]}")
     return out_path
+
+
+async def build_thumbnail(
+    title: str,
+    custom_prompt: str = "",
+    clips: Callable[[], Awaitable[list[Path] | None]] | None = None,
+    report: dict | None = None,
+    slot: Callable[[], AsyncContextManager] | None = None,
+) -> Path:
+    """fal.ai thumbnail, falling back to ``local_thumbnail``.
+
+    The local path is used when fal is not configured, fails, or takes
+    longer than ``THUMBNAIL_TIMEOUT`` seconds. ``clips`` is only awaited
+    then, so the fal request doesn't wait for the stock clips. ``slot`` is
+    held around the fal request only (e.g. a scheduler network slot).
+    ``report`` records which source was used.
+    """
+    report = report if report is not None else {}
+    if settings.fal_key:
+        try:
+            async with slot() if slot else nullcontext():
+                path = await asyncio.wait_for(
+                    generate_thumbnail(title, custom_prompt), timeout=settings.thumbnail_timeout
+                )
+            report["source"] = "fal"
+            return path
+        except Exception as e:
+            if clips is None:
+                raise
+            report["fal_error"] = str(e) or type(e).__name__
+    report["source"] = "local"
+    return await local_thumbnail(title, (await clips() if clips else None) or [])
+
+
+async def thumbnail_variant(source: Path, variant: str) -> Path:
+    """JPEG of ``source`` within ``variant``'s size limits (see VARIANTS).
+
+    Downscaled with area averaging (never upscaled) and cached by the
+    source's content hash, so each variant is encoded once per image.
+    """
+    max_w, max_h, max_bytes = VARIANTS[variant]
+    digest = hashlib.sha256(source.read_bytes()).hexdigest()
+    key = f"{variant}:{digest}"
+    entry = thumbnail_variants.get(key)
+    if entry:
+        return entry.path
+
+    settings.ensure_dirs()
+    out_path = settings.thumbs_dir / f"{digest[:16]}_{variant}.jpg"
+    vf = (
+        f"scale='min({max_w},iw)':'min({max_h},ih)'"
+        ":force_original_aspect_ratio=decrease:flags=area"
+    )
+    for quality in JPEG_QUALITIES:
+        cmd = [
+            "ffmpeg", "-y", "-i", str(source), "-frames:v", "1", "-vf", vf,
+            "-q:v", str(quality), str(out_path),
+        ]
+        returncode, _, stderr = await run_process(cmd, timeout=30)
+        if returncode != 0:
+            out_path.unlink(missing_ok=True)
+            raise RuntimeError(f"Thumbnail {variant} resize failed: {stderr.decode()[-500:]}")
+        if out_path.stat().st_size < max_bytes:
+            thumbnail_variants.put(key, out_path, meta={"source": str(source)})
+            return out_path
+    out_path.unlink(missing_ok=True)
+    raise RuntimeError(f"Thumbnail does not fit the {variant} limit of {max_bytes} bytes")
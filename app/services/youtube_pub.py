@@ -1,24 +1,56 @@
 import json
 import asyncio
+import random
+import time
 from pathlib import Path
 
+import httplib2
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 
 from app.config import settings
+from app.services.db import get_conn
+from app.services.ffmpeg import ProgressCallback
+from app.services.thumbnail import thumbnail_variant
 
-TOKEN_FILE = Path("/media/dhamma/youtube_token.json")
+# Resumable upload chunks must be multiples of 256 KiB
+CHUNK_UNIT = 256 * 1024
+MIN_CHUNK = 4 * 1024 * 1024
+MAX_CHUNK = 128 * 1024 * 1024
+INITIAL_CHUNK = 8 * 1024 * 1024
+# Chunk size is tuned so one chunk takes about this long at the measured rate
+TARGET_CHUNK_SECONDS = 10
+
+MAX_RETRIES = 8
+MAX_BACKOFF = 64
+RETRY_STATUSES = (500, 502, 503, 504)
+TRANSPORT_ERRORS = (OSError, TimeoutError, httplib2.HttpLib2Error)
+
+# Open upload sessions by file identity, so an interrupted upload of the
+# same file continues where it stopped (sessions stay valid about a week)
+UPLOAD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS youtube_uploads (
+    key TEXT PRIMARY KEY,
+    resumable_uri TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def token_file() -> Path:
+    return settings.media_path / "youtube_token.json"
 
 
 def get_youtube_service():
     """Build YouTube API service from stored credentials."""
-    if not TOKEN_FILE.exists():
+    if not token_file().exists():
         raise ValueError(
             "YouTube not authorized. Visit /api/youtube/auth to authorize."
         )
 
-    creds_data = json.loads(TOKEN_FILE.read_text())
+    creds_data = json.loads(token_file().read_text())
     creds = Credentials(
         token=creds_data["token"],
         refresh_token=creds_data.get("refresh_token"),
@@ -29,14 +61,57 @@ def get_youtube_service():
     return build("youtube", "v3", credentials=creds)
 
 
+def _upload_key(path: Path) -> str:
+    st = path.stat()
+    return f"{path.resolve()}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _saved_session(key: str) -> str | None:
+    row = get_conn(UPLOAD_SCHEMA).execute(
+        "SELECT resumable_uri FROM youtube_uploads WHERE key = ?", (key,)
+    ).fetchone()
+    return row["resumable_uri"] if row else None
+
+
+def _save_session(key: str, uri: str | None):
+    conn = get_conn(UPLOAD_SCHEMA)
+    if uri is None:
+        conn.execute("DELETE FROM youtube_uploads WHERE key = ?", (key,))
+        return
+    conn.execute(
+        "INSERT INTO youtube_uploads (key, resumable_uri, created_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET resumable_uri=excluded.resumable_uri",
+        (key, uri, time.time()),
+    )
+
+
+def _next_chunk_size(bytes_per_second: float) -> int:
+    size = int(bytes_per_second * TARGET_CHUNK_SECONDS) // CHUNK_UNIT * CHUNK_UNIT
+    return max(MIN_CHUNK, min(MAX_CHUNK, size))
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, HttpError):
+        return e.resp.status in RETRY_STATUSES
+    return isinstance(e, TRANSPORT_ERRORS)
+
+
 async def publish_to_youtube(
     video_path: Path,
     title: str,
     description: str = "",
     tags: list[str] | None = None,
     thumbnail_path: Path | None = None,
+    on_progress: ProgressCallback | None = None,
 ) -> str:
-    """Upload video to YouTube with optional custom thumbnail."""
+    """Upload video to YouTube with optional custom thumbnail.
+
+    The resumable upload runs one chunk per worker thread, so the event loop
+    stays free and the upload can be cancelled between chunks. Transient
+    chunk errors are retried with exponential backoff. The session URI is
+    saved, so an interrupted upload of the same file resumes from the
+    server's offset. Chunk size follows the measured throughput.
+    """
     if tags is None:
         tags = [
             "Dhamma", "Buddhism", "Myanmar", "Burmese",
@@ -52,42 +127,83 @@ async def publish_to_youtube(
             "defaultLanguage": "my",
         },
         "status": {
-            "privacyStatus": "public",
+            "privacyStatus": settings.youtube_privacy,
             "selfDeclaredMadeForKids": False,
         },
     }
 
+    youtube = await asyncio.to_thread(get_youtube_service)
+    key = _upload_key(video_path)
     media = MediaFileUpload(
         str(video_path),
         mimetype="video/mp4",
         resumable=True,
-        chunksize=10 * 1024 * 1024,
+        chunksize=INITIAL_CHUNK,
+    )
+    request = youtube.videos().insert(
+        part="snippet,status",
+        body=body,
+        media_body=media,
     )
+    saved_uri = _saved_session(key)
+    if saved_uri:
+        # Ask the server how far the earlier attempt got before sending data
+        request.resumable_uri = saved_uri
+        request._in_error_state = True
 
-    def _upload():
-        youtube = get_youtube_service()
-        request = youtube.videos().insert(
-            part="snippet,status",
-            body=body,
-            media_body=media,
-        )
-        response = None
+    def remember_session():
+        nonlocal saved_uri
+        if request.resumable_uri and request.resumable_uri != saved_uri:
+            saved_uri = request.resumable_uri
+            _save_session(key, saved_uri)
+
+    response = None
+    retries = 0
+    try:
         while response is None:
-            _, response = request.next_chunk()
+            started = time.monotonic()
+            offset = request.resumable_progress
+            try:
+                status, response = await asyncio.to_thread(request.next_chunk)
+            except (HttpError, *TRANSPORT_ERRORS) as e:
+                remember_session()
+                if isinstance(e, HttpError) and e.resp.status in (404, 410) and saved_uri:
+                    # Session expired: start a new upload from the beginning
+                    _save_session(key, None)
+                    saved_uri = None
+                    request.resumable_uri = None
+                    request.resumable_progress = 0
+                    request._in_error_state = False
+                    continue
+                if not _is_transient(e) or retries >= MAX_RETRIES:
+                    raise
+                retries += 1
+                await asyncio.sleep(min(MAX_BACKOFF, 2 ** retries) + random.random())
+                continue
+            retries = 0
+            remember_session()
 
-        video_id = response["id"]
+            sent = request.resumable_progress - offset
+            elapsed = time.monotonic() - started
+            if sent > 0 and elapsed > 0:
+                media._chunksize = _next_chunk_size(sent / elapsed)
+            if status and on_progress:
+                on_progress(status.progress())
+    finally:
+        media.stream().close()
 
-        # Set custom thumbnail if available
-        if thumbnail_path and thumbnail_path.exists():
-            thumb_media = MediaFileUpload(
-                str(thumbnail_path), mimetype="image/png"
-            )
-            youtube.thumbnails().set(
-                videoId=video_id, media_body=thumb_media
-            ).execute()
+    _save_session(key, None)
+    video_id = response["id"]
 
-        return response
+    # Set custom thumbnail if available, as a JPEG under YouTube's 2 MB limit
+    if thumbnail_path and thumbnail_path.exists():
+        thumb = await thumbnail_variant(thumbnail_path, "youtube")
+        thumb_media = MediaFileUpload(str(thumb), mimetype="image/jpeg")
+        await asyncio.to_thread(
+            youtube.thumbnails().set(videoId=video_id, media_body=thumb_media).execute,
+            num_retries=3,
+        )
 
-    response = await asyncio.to_thread(_upload)
-    video_id = response["id"]
+    if on_progress:
+        on_progress(1.0)
     return f"https://www.youtube.com/watch?v={video_id}"
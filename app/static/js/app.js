@@ -9,15 +9,22 @@ const resultsSection = document.getElementById('resultsSection');
 const jobList = document.getElementById('jobList');
 const failBanner = document.getElementById('failBanner');
 const failMsg = document.getElementById('failMsg');
+const failTitle = document.getElementById('failTitle');
+const cancelBtn = document.getElementById('cancelBtn');
+const retryBtn = document.getElementById('retryBtn');
+let currentJobId = null;
 
 // Ordered pipeline steps
 const STEPS = [
     'downloading',
     'enhancing',
     'fetching_stock',
+    'normalizing_stock',
     'generating_thumbnail',
+    'sizing_thumbnail',
     'compiling',
     'publishing',
+    'publishing_youtube',
     'cleanup',
 ];
 
@@ -35,6 +42,7 @@ async function checkConfig() {
         setDot('pexelsDot', cfg.pexels);
         setDot('falDot', cfg.fal);
         setDot('telegramDot', cfg.telegram);
+        setDot('youtubeDot', cfg.youtube);
     } catch (e) {
         console.error('Config check failed:', e);
     }
@@ -62,8 +70,8 @@ function resetTimeline() {
     failMsg.textContent = '';
 }
 
-// Update the timeline based on current step
-function updateTimeline(currentStep, progress, status) {
+// Update the timeline based on current step (or per-stage status when available)
+function updateTimeline(currentStep, progress, status, stages) {
     const currentIdx = STEPS.indexOf(currentStep);
 
     STEPS.forEach((step, i) => {
@@ -72,8 +80,24 @@ function updateTimeline(currentStep, progress, status) {
 
         row.classList.remove('active', 'done', 'failed');
         const statusEl = row.querySelector('.step-status');
+        const stage = stages ? stages[step] : null;
 
-        if (status === 'failed' && i === currentIdx) {
+        if (stages && !stage) {
+            statusEl.textContent = (currentStep === 'done' || status === 'failed') ? 'Skipped' : '';
+        } else if (stage) {
+            if (stage.status === 'done') {
+                row.classList.add('done');
+                statusEl.textContent = 'Done';
+            } else if (stage.status === 'failed') {
+                row.classList.add('failed');
+                statusEl.textContent = 'FAILED';
+            } else if (stage.status === 'running') {
+                row.classList.add('active');
+                statusEl.textContent = stage.progress ? stage.progress + '%' : 'Running';
+            } else {
+                statusEl.textContent = stage.status === 'pending' ? '' : stage.status;
+            }
+        } else if (status === 'failed' && i === currentIdx) {
             row.classList.add('failed');
             statusEl.textContent = 'FAILED';
         } else if (i < currentIdx || (currentStep === 'done' && status === 'completed')) {
@@ -108,6 +132,7 @@ form.addEventListener('submit', async (e) => {
         title: document.getElementById('title').value,
         description: document.getElementById('description').value,
         publish_telegram: document.getElementById('pubTelegram').checked,
+        publish_youtube: document.getElementById('pubYoutube').checked,
         stock_clip_count: parseInt(document.getElementById('clipCount').value) || 5,
         generate_thumbnail: document.getElementById('genThumbnail').checked,
         thumbnail_prompt: document.getElementById('thumbnailPrompt').value,
@@ -120,7 +145,7 @@ form.addEventListener('submit', async (e) => {
             body: JSON.stringify(data),
         });
         const job = await res.json();
-        pollJob(job.job_id);
+        watchJob(job.job_id);
     } catch (err) {
         alert('Failed to start job: ' + err.message);
         submitBtn.disabled = false;
@@ -128,31 +153,89 @@ form.addEventListener('submit', async (e) => {
     }
 });
 
-async function pollJob(jobId) {
+// Apply a job status update; returns true once the job has finished
+function handleJobUpdate(job) {
+    updateTimeline(job.step, job.progress, job.status, job.stages);
+    if (job.status === 'queued' && job.queue_position) {
+        progressPct.textContent = `Queued #${job.queue_position}`;
+    } else if (job.status === 'rendered') {
+        progressPct.textContent = 'Rendered, publishing';
+    }
+
+    if (!['completed', 'failed', 'cancelled'].includes(job.status)) return false;
+
+    submitBtn.disabled = false;
+    submitBtn.textContent = 'Convert & Publish';
+    cancelBtn.style.display = 'none';
+
+    if (job.status === 'completed') {
+        showResults(job);
+    } else {
+        failBanner.classList.add('active');
+        failTitle.textContent = job.status === 'cancelled' ? 'Job Cancelled' : 'Job Failed';
+        failMsg.textContent = job.error || 'An unknown error occurred.';
+    }
+    loadJobs();
+    return true;
+}
+
+// Follow a job over Server-Sent Events, falling back to polling if unsupported
+function watchJob(jobId) {
+    currentJobId = jobId;
     progressSection.classList.add('active');
     resultsSection.classList.remove('active');
+    cancelBtn.style.display = '';
+    cancelBtn.disabled = false;
     resetTimeline();
 
+    if (!window.EventSource) {
+        pollJob(jobId);
+        return;
+    }
+
+    let finished = false;
+    const source = new EventSource(`${API}/jobs/${jobId}/events`);
+    source.onmessage = (e) => {
+        finished = handleJobUpdate(JSON.parse(e.data));
+        if (finished) source.close();
+    };
+    source.onerror = () => {
+        source.close();
+        if (!finished) pollJob(jobId);
+    };
+}
+
+// Cancel the job being watched; the status stream reports the outcome
+cancelBtn.addEventListener('click', async () => {
+    if (!currentJobId) return;
+    cancelBtn.disabled = true;
+    try {
+        await fetch(`${API}/jobs/${currentJobId}`, { method: 'DELETE' });
+    } catch (e) {
+        console.error('Cancel failed:', e);
+        cancelBtn.disabled = false;
+    }
+});
+
+// Resume a failed or cancelled job; finished stages are not redone
+retryBtn.addEventListener('click', async () => {
+    if (!currentJobId) return;
+    try {
+        const res = await fetch(`${API}/jobs/${currentJobId}/retry`, { method: 'POST' });
+        const job = await res.json();
+        if (job.error) throw new Error(job.error);
+        watchJob(job.job_id);
+    } catch (e) {
+        alert('Retry failed: ' + e.message);
+    }
+});
+
+function pollJob(jobId) {
     const poll = setInterval(async () => {
         try {
             const res = await fetch(`${API}/jobs/${jobId}`);
             const job = await res.json();
-
-            updateTimeline(job.step, job.progress, job.status);
-
-            if (job.status === 'completed' || job.status === 'failed') {
-                clearInterval(poll);
-                submitBtn.disabled = false;
-                submitBtn.textContent = 'Convert & Publish';
-
-                if (job.status === 'completed') {
-                    showResults(job);
-                } else {
-                    failBanner.classList.add('active');
-                    failMsg.textContent = job.error || 'An unknown error occurred.';
-                }
-                loadJobs();
-            }
+            if (handleJobUpdate(job)) clearInterval(poll);
         } catch (e) {
             console.error('Poll error:', e);
         }
@@ -204,13 +287,25 @@ function showResults(job) {
         </div>`;
     }
 
+    if (job.youtube_result && !job.youtube_result.startsWith('Error')) {
+        html += `<div class="result-item">
+            <span class="label">YouTube</span>
+            <span class="value success"><a href="${job.youtube_result}" target="_blank">Watch</a></span>
+        </div>`;
+    } else if (job.youtube_result) {
+        html += `<div class="result-item">
+            <span class="label">YouTube</span>
+            <span class="value error">${job.youtube_result}</span>
+        </div>`;
+    }
+
     document.getElementById('resultsList').innerHTML = html;
 }
 
 async function loadJobs() {
     try {
-        const res = await fetch(`${API}/jobs`);
-        const data = await res.json();
+        const res = await fetch(`${API}/jobs?limit=10`);
+        const data = (await res.json()).jobs;
 
         if (!data.length) {
             jobList.innerHTML = '<p style="color:var(--gray);font-size:13px;text-align:center;padding:12px 0;">No jobs yet</p>';